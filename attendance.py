@@ -0,0 +1,115 @@
+"""Per-session attendance as bitmaps over enrollment ordinals.
+
+Every enrollment takes the next ordinal of its class (0, 1, 2, ...) and a
+class session records who checked in as a bitmap with bit ``ordinal``
+set, so a 500-student session is 63 bytes. Bitmaps are stored as
+little-endian ``bytes`` and handled here as Python ints: headcounts,
+rates, streaks and absentees for a whole class are a few big-integer
+operations per session rather than a row per student.
+
+A session also records ``roster_size``, the ordinals handed out when it
+started. Students who enrolled later are not counted absent from it.
+"""
+from collections import namedtuple
+
+StudentAttendance = namedtuple('StudentAttendance', ['attended', 'eligible', 'rate', 'streak'])
+
+
+def decode(blob):
+    return int.from_bytes(blob or b'', 'little')
+
+
+def encode(bits):
+    return bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+
+
+def check_in(blob, ordinal):
+    """``blob`` with ``ordinal`` set, and whether it was newly set."""
+    bits = decode(blob)
+    if bits >> ordinal & 1:
+        return blob, False
+    return encode(bits | 1 << ordinal), True
+
+
+def members(bits):
+    """Ordinals set in ``bits``, lowest first."""
+    while bits:
+        lowest = bits & -bits
+        yield lowest.bit_length() - 1
+        bits ^= lowest
+
+
+class Counter:
+    """A count per ordinal, kept as bit planes.
+
+    Adding a bitmap is a ripple-carry add over whole ints, so counting n
+    sessions for every student costs about n * log2(n) int operations.
+    """
+
+    def __init__(self):
+        self.planes = []
+
+    def add(self, bits):
+        for index, plane in enumerate(self.planes):
+            if not bits:
+                return
+            self.planes[index], bits = plane ^ bits, plane & bits
+        if bits:
+            self.planes.append(bits)
+
+    def get(self, ordinal):
+        return sum((plane >> ordinal & 1) << index for index, plane in enumerate(self.planes))
+
+
+class SessionLog:
+    """Attendance of one class over a run of sessions.
+
+    ``sessions`` are ``(roster_size, blob)`` pairs, oldest first.
+    """
+
+    def __init__(self, sessions):
+        self.attended = []
+        self.eligible = []
+        for roster_size, blob in sessions:
+            bits = decode(blob)
+            self.attended.append(bits)
+            # Late enrollees who checked in anyway count as present
+            self.eligible.append((1 << roster_size) - 1 | bits)
+        self._counts = None
+
+    def __len__(self):
+        return len(self.attended)
+
+    def headcounts(self):
+        return [bits.bit_count() for bits in self.attended]
+
+    def rate(self):
+        """Share of expected check-ins that happened, or None without sessions."""
+        expected = sum(bits.bit_count() for bits in self.eligible)
+        return sum(self.headcounts()) / expected if expected else None
+
+    def _tally(self):
+        if self._counts is None:
+            attended, eligible, streak = Counter(), Counter(), Counter()
+            for bits, expected in zip(self.attended, self.eligible):
+                attended.add(bits)
+                eligible.add(expected)
+            # Newest first: a streak survives the sessions a student attended
+            # or was not enrolled for yet, and ends at the first one missed
+            alive = -1
+            for bits, expected in zip(reversed(self.attended), reversed(self.eligible)):
+                alive &= bits | ~expected
+                streak.add(alive & bits)
+            self._counts = attended, eligible, streak
+        return self._counts
+
+    def student(self, ordinal):
+        attended, eligible, streak = (counter.get(ordinal) for counter in self._tally())
+        return StudentAttendance(attended, eligible, attended / eligible if eligible else None, streak)
+
+    def absentees(self, min_rate):
+        """Ordinals expected at one session at least and present at fewer than ``min_rate`` of them."""
+        expected = 0
+        for bits in self.eligible:
+            expected |= bits
+        return {ordinal for ordinal in members(expected) if self.student(ordinal).rate < min_rate}
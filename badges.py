@@ -0,0 +1,59 @@
+"""Process-local badge catalogue cache.
+
+Badges are kept as a threshold array sorted by ``points_required`` so the
+badges earned by a points change are the slice between two bisects.
+"""
+import threading
+import time
+from bisect import bisect_right
+
+
+class BadgeCatalog:
+    """Sorted badge thresholds, reloaded after invalidation or ``ttl`` seconds.
+
+    ``load`` returns ``(badge_id, points_required, name, icon)`` rows for
+    the whole catalogue. Invalidation only reaches this process, so the
+    catalogue is also reloaded every ``ttl`` seconds for badges changed
+    elsewhere; a load that an invalidation overtook is used but not kept.
+    """
+
+    def __init__(self, load, ttl=60):
+        self._load = load
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._catalogue = None
+        self._expires = 0
+        self._generation = 0
+
+    def _ensure_loaded(self):
+        catalogue = self._catalogue
+        if catalogue is None or time.monotonic() >= self._expires:
+            with self._lock:
+                generation = self._generation
+            rows = sorted(self._load(), key=lambda row: (row[1] or 0, row[0]))
+            catalogue = ([row[1] or 0 for row in rows], [row[0] for row in rows],
+                         {row[0]: {'id': row[0], 'name': row[2], 'icon': row[3]} for row in rows})
+            with self._lock:
+                if self._generation == generation:
+                    self._catalogue, self._expires = catalogue, time.monotonic() + self.ttl
+        return catalogue
+
+    def describe(self, badge_id):
+        return self._ensure_loaded()[2].get(badge_id, {'id': badge_id})
+
+    def crossed(self, old_points, new_points):
+        """Badge ids whose threshold lies in ``(old_points, new_points]``."""
+        if new_points <= old_points:
+            return []
+        thresholds, badge_ids, _ = self._ensure_loaded()
+        return badge_ids[bisect_right(thresholds, old_points):bisect_right(thresholds, new_points)]
+
+    def earned(self, points):
+        """Badge ids whose threshold is at most ``points``."""
+        thresholds, badge_ids, _ = self._ensure_loaded()
+        return badge_ids[:bisect_right(thresholds, points)]
+
+    def invalidate(self):
+        with self._lock:
+            self._catalogue = None
+            self._generation += 1
@@ -0,0 +1,393 @@
+"""Endpoint latency benchmark: every route under concurrent load.
+
+Drives each route through the Flask test client from ``--threads``
+threads, each logged in as its own student or teacher, and reports
+p50/p95/p99 latency, throughput and SQL statements per request. Without
+``--database`` a dataset is generated with ``datagen.py`` in a temporary
+directory first.
+
+    python bench_endpoints.py --scale small --threads 8 --requests 200 --json results.json
+    python bench_endpoints.py --database sqlite:////tmp/elearning-large.db --compare results.json
+
+SQL statements run by the submission writer thread are not attributed to
+the request that queued them; set ``SUBMISSION_FLUSH_MS=0`` to count them.
+The SSE streams are not benchmarked.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', help='existing database URL to benchmark (default: generate one)')
+    parser.add_argument('--scale', default='small', help='datagen scale when generating a database')
+    parser.add_argument('--threads', type=int, default=8, help='concurrent clients per endpoint')
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint')
+    parser.add_argument('--endpoints', help='comma separated endpoint names to run (default: all)')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--json', dest='json_path', help='write the results to this file')
+    parser.add_argument('--compare', help='earlier --json results to print p95 and throughput changes against')
+    return parser.parse_args()
+
+
+class Client:
+    """A test client, logged in unless ``username`` is None, and the ids its requests refer to."""
+
+    def __init__(self, app_module, rng, username=None, password=None):
+        self.client = app_module.app.test_client()
+        self.username, self.password = username, password
+        if username is not None:
+            self.client.post('/login', json={'username': username, 'password': password})
+        self.rng = rng
+        self.counter = itertools.count()
+        self.fresh = {}
+
+
+def build_clients(app_module, role, count, rng):
+    db = app_module.db
+    User, OnlineClass, ClassEnrollment = app_module.User, app_module.OnlineClass, app_module.ClassEnrollment
+    with app_module.app.app_context():
+        if role == 'teacher':
+            rows = db.session.query(User.id, User.username, OnlineClass.id)\
+                .join(OnlineClass, OnlineClass.teacher_id == User.id).filter(User.username.like('gen-%'))\
+                .group_by(User.id).order_by(User.id).limit(count).all()
+        else:
+            rows = db.session.query(User.id, User.username, db.func.min(ClassEnrollment.class_id))\
+                .join(ClassEnrollment, ClassEnrollment.user_id == User.id).filter(User.username.like('gen-%'))\
+                .group_by(User.id).order_by(User.id).limit(count).all()
+        activities = {}
+        for user_id, username, class_id in rows:
+            if class_id not in activities:
+                activities[class_id] = {
+                    'quiz': [row[0] for row in db.session.query(app_module.Quiz.id).filter_by(class_id=class_id)
+                             .filter(app_module.Quiz.answer_key.is_(None))],
+                    'test': [tuple(row) for row in db.session.query(app_module.Quiz.id, app_module.Quiz.question_count)
+                             .filter_by(class_id=class_id).filter(app_module.Quiz.answer_key.isnot(None))],
+                    'poll': [row[0] for row in db.session.query(app_module.Poll.id).filter_by(class_id=class_id)],
+                    'challenge': [row[0] for row in db.session.query(app_module.Challenge.id).filter_by(class_id=class_id)],
+                }
+        class_codes = [row[0] for row in db.session.query(OnlineClass.class_code).limit(1000)]
+
+    password = 'teacher123' if role == 'teacher' else 'student123'
+    clients = []
+    for user_id, username, class_id in rows:
+        client = Client(app_module, random.Random(rng.random()), username, password)
+        client.class_id = class_id
+        client.activities = activities[class_id]
+        client.class_codes = class_codes
+        clients.append(client)
+    if not clients:
+        raise SystemExit(f'No generated {role}s in the database; fill it with datagen.py first')
+    return clients
+
+
+def add_fresh_activities(app_module, clients):
+    """Create a poll, challenge and test in the class of each student client, submitted to first.
+
+    Generated students have answered most activities of their classes, so
+    without these nearly every submission is refused as a repeat.
+    """
+    db, User, OnlineClass = app_module.db, app_module.User, app_module.OnlineClass
+    with app_module.app.app_context():
+        teachers = dict(db.session.query(OnlineClass.id, User.username).join(User, User.id == OnlineClass.teacher_id)
+                        .filter(OnlineClass.id.in_({client.class_id for client in clients})))
+    fresh = {}
+    for class_id, username in teachers.items():
+        teacher = Client(app_module, None, username, 'teacher123').client
+        poll = teacher.post('/api/create_poll', json={
+            'class_id': class_id, 'question': 'Fresh?', 'option_1': 'a', 'option_2': 'b', 'option_3': 'c',
+            'option_4': 'd'}).get_json()
+        challenge = teacher.post('/api/create_challenge', json={
+            'class_id': class_id, 'title': 'Fresh', 'description': 'bench'}).get_json()
+        test = teacher.post('/api/create_quiz', json={'class_id': class_id, 'title': 'Fresh test', 'questions': [
+            {'question': f'Question {n}?', 'options': ['a', 'b', 'c', 'd'], 'correct_answer': 'a'} for n in range(2)]
+        }).get_json()
+        fresh[class_id] = {'poll': poll['poll_id'], 'challenge': challenge['challenge_id'],
+                           'test': (test['quiz_id'], 2)}
+    for client in clients:
+        client.fresh = {kind: [activity] for kind, activity in fresh[client.class_id].items()}
+
+
+def pick(client, kind):
+    return client.rng.choice(client.activities[kind] or [0])
+
+
+def pick_unanswered(client, kind):
+    # The client's fresh activity once, then any; repeats are refused
+    if client.fresh.get(kind):
+        return client.fresh[kind].pop()
+    return pick(client, kind)
+
+
+def new_user(c):
+    name = f'bench-{os.getpid()}-{id(c)}-{next(c.counter)}'
+    return {'username': name, 'email': f'{name}@example.com', 'password': 'student123', 'role': 'student'}
+
+
+def quiz_answer(c):
+    return {'quiz_id': pick(c, 'quiz'), 'answer': c.rng.choice('abcd')}
+
+
+def test_answers(c):
+    if c.fresh.get('test'):
+        quiz_id, count = pick_unanswered(c, 'test')
+    else:
+        quiz_id, count = c.rng.choice(c.activities['test'] or [(0, 1)])
+    return {'quiz_id': quiz_id, 'answers': [c.rng.choice('abcd') for _ in range(count)]}
+
+
+def poll_vote(c):
+    return {'poll_id': pick_unanswered(c, 'poll'), 'selected_option': c.rng.randint(1, 4)}
+
+
+def challenge_entry(c):
+    return {'challenge_id': pick_unanswered(c, 'challenge'), 'submission': 'bench'}
+
+
+# name: (role, method, path, json body); role None is an anonymous client
+ENDPOINTS = {
+    'index': (None, 'GET', lambda c: '/', None),
+    'readyz': (None, 'GET', lambda c: '/readyz', None),
+    'register': (None, 'POST', lambda c: '/register', lambda c: new_user(c)),
+    # Logs in again as the client's own student, whose class the later endpoints use
+    'login': ('student', 'POST', lambda c: '/login', lambda c: {'username': c.username, 'password': c.password}),
+    'dashboard_page': ('student', 'GET', lambda c: '/dashboard', None),
+    'dashboard_page_teacher': ('teacher', 'GET', lambda c: '/dashboard', None),
+    'api_dashboard': ('student', 'GET', lambda c: '/api/dashboard', None),
+    'api_dashboard_teacher': ('teacher', 'GET', lambda c: '/api/dashboard', None),
+    'class': ('student', 'GET', lambda c: f'/api/classes/{c.class_id}', None),
+    'quiz': ('student', 'GET', lambda c: f"/api/quiz/{pick(c, 'quiz')}", None),
+    'test': ('student', 'GET', lambda c: f"/api/quiz/{c.rng.choice(c.activities['test'] or [(0, 1)])[0]}", None),
+    'poll': ('student', 'GET', lambda c: f"/api/poll/{pick(c, 'poll')}", None),
+    'challenge': ('student', 'GET', lambda c: f"/api/challenge/{pick(c, 'challenge')}", None),
+    'leaderboard': ('student', 'GET', lambda c: f'/api/leaderboard?offset={c.rng.randint(0, 500)}', None),
+    'leaderboard_week': ('student', 'GET', lambda c: '/api/leaderboard?days=7', None),
+    'class_leaderboard_week': ('student', 'GET', lambda c: f'/api/classes/{c.class_id}/leaderboard?days=7', None),
+    'leaderboard_me': ('student', 'GET', lambda c: '/api/leaderboard/me', None),
+    'class_leaderboard': ('student', 'GET', lambda c: f'/api/classes/{c.class_id}/leaderboard', None),
+    'discussions': ('student', 'GET', lambda c: f'/api/discussion/{c.class_id}', None),
+    'search': ('student', 'GET', lambda c: f'/api/classes/{c.class_id}/search?q=post', None),
+    'recommendations': ('student', 'GET', lambda c: '/api/recommendations', None),
+    'recommendations_teacher': ('teacher', 'GET', lambda c: '/api/recommendations', None),
+    'user_points': ('student', 'GET', lambda c: '/api/user/points', None),
+    'badges': ('student', 'GET', lambda c: '/api/badges', None),
+    'analytics': ('teacher', 'GET', lambda c: f'/api/analytics/{c.class_id}', None),
+    'gradebook': ('teacher', 'GET', lambda c: f'/api/classes/{c.class_id}/gradebook', None),
+    'gradebook_csv': ('teacher', 'GET', lambda c: f'/api/classes/{c.class_id}/gradebook?format=csv', None),
+    'sessions': ('student', 'GET', lambda c: f'/api/classes/{c.class_id}/sessions', None),
+    'class_attendance': ('teacher', 'GET', lambda c: f'/api/classes/{c.class_id}/attendance', None),
+    'poll_results': ('teacher', 'GET', lambda c: f"/api/poll/{pick(c, 'poll')}/results", None),
+    'submit_quiz': ('student', 'POST', lambda c: '/api/submit_quiz', quiz_answer),
+    'submit_test': ('student', 'POST', lambda c: '/api/submit_quiz', test_answers),
+    'submit_poll': ('student', 'POST', lambda c: '/api/submit_poll', poll_vote),
+    'submit_challenge': ('student', 'POST', lambda c: '/api/submit_challenge', challenge_entry),
+    'submit_batch': ('student', 'POST', lambda c: '/api/submit_batch', lambda c: {'submissions': [
+        dict(quiz_answer(c), type='quiz'), dict(poll_vote(c), type='poll'), dict(challenge_entry(c), type='challenge')]}),
+    'attendance': ('student', 'POST', lambda c: '/api/attendance', lambda c: {'class_id': c.class_id}),
+    'post_discussion': ('student', 'POST', lambda c: '/api/discussion', lambda c: {'class_id': c.class_id, 'content': 'bench'}),
+    'join_class': ('student', 'POST', lambda c: '/api/join_class', lambda c: {'class_code': c.rng.choice(c.class_codes)}),
+    'create_class': ('teacher', 'POST', lambda c: '/api/create_class', lambda c: {'title': 'Bench class'}),
+    'start_session': ('teacher', 'POST', lambda c: f'/api/classes/{c.class_id}/sessions', lambda c: {'title': 'Bench'}),
+    'create_quiz': ('teacher', 'POST', lambda c: '/api/create_quiz', lambda c: {
+        'class_id': c.class_id, 'title': 'Bench', 'question': '?', 'option_a': 'a', 'option_b': 'b',
+        'option_c': 'c', 'option_d': 'd', 'correct_answer': 'a'}),
+    'create_test': ('teacher', 'POST', lambda c: '/api/create_quiz', lambda c: {
+        'class_id': c.class_id, 'title': 'Bench test', 'questions': [
+            {'question': f'Question {n}?', 'options': ['a', 'b', 'c', 'd'], 'correct_answer': 'a'} for n in range(20)]}),
+    'create_poll': ('teacher', 'POST', lambda c: '/api/create_poll', lambda c: {
+        'class_id': c.class_id, 'question': '?', 'option_1': 'a', 'option_2': 'b'}),
+    'create_challenge': ('teacher', 'POST', lambda c: '/api/create_challenge', lambda c: {
+        'class_id': c.class_id, 'title': 'Bench', 'description': 'bench'}),
+}
+
+# name: every status the endpoint may answer, when not just 200; activities and
+# class codes are picked at random, so some submissions and joins are repeats
+STATUSES = {
+    'register': {201},
+    'submit_test': {200, 400},
+    'submit_poll': {200, 400},
+    'submit_challenge': {200, 400},
+    'post_discussion': {201},
+    'join_class': {201, 400},
+    'create_class': {201},
+    'start_session': {201},
+    'create_quiz': {201},
+    'create_test': {201},
+    'create_poll': {201},
+    'create_challenge': {201},
+}
+
+
+def unexpected_status(name, method, path, response):
+    """A description of ``response`` if endpoint ``name`` should never answer with its status, else None."""
+    if response.status_code in STATUSES.get(name, {200}):
+        return None
+    return f'{name}: {method} {path} answered {response.status_code} {response.get_data(as_text=True)[:200]!r}'
+
+
+class QueryCounter:
+    """Counts SQL statements per thread on every engine of the app."""
+
+    def __init__(self, app_module):
+        from sqlalchemy import event
+
+        self._local = threading.local()
+        with app_module.app.app_context():
+            for engine in app_module.db.engines.values():
+                event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    def reset(self):
+        self._local.count = 0
+
+    @property
+    def count(self):
+        return getattr(self._local, 'count', 0)
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))] if values else 0
+
+
+def run_endpoint(app_module, queries, clients, spec, requests, threads):
+    role, method, path, body = spec
+    latencies, statements, statuses = [], [], {}
+    lock = threading.Lock()
+    per_thread = max(1, requests // threads)
+    start_line = threading.Barrier(threads + 1)
+
+    def worker(client):
+        local_latencies, local_statements, local_statuses = [], [], {}
+        start_line.wait()
+        for _ in range(per_thread):
+            url = path(client)
+            payload = body(client) if body else None
+            queries.reset()
+            started = time.perf_counter()
+            response = client.client.open(url, method=method, json=payload)
+            local_latencies.append(time.perf_counter() - started)
+            local_statements.append(queries.count)
+            local_statuses[response.status_code] = local_statuses.get(response.status_code, 0) + 1
+            response.close()
+        with lock:
+            latencies.extend(local_latencies)
+            statements.extend(local_statements)
+            for status, count in local_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    pool = clients[role] if role else [Client(app_module, random.Random(i)) for i in range(threads)]
+    workers = [threading.Thread(target=worker, args=(pool[i % len(pool)],)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    start_line.wait()
+    started = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    total = len(latencies)
+    return {
+        'requests': total,
+        'errors': sum(count for status, count in statuses.items() if status >= 500),
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'throughput': round(total / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'mean_ms': round(sum(latencies) / total * 1000, 2),
+        'queries_mean': round(sum(statements) / total, 1),
+        'queries_max': max(statements),
+    }
+
+
+def dataset_counts(app_module):
+    db = app_module.db
+    with app_module.app.app_context():
+        return {model.__tablename__: db.session.query(db.func.count()).select_from(model).scalar() for model in (
+            app_module.User, app_module.OnlineClass, app_module.ClassEnrollment, app_module.QuizResponse,
+            app_module.PollResponse, app_module.ChallengeResponse, app_module.DiscussionPost)}
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_comparison(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)['endpoints']
+    print(f'\n{"endpoint":>24} {"p95 before":>11} {"p95 after":>10} {"change":>8} {"req/s before":>13} {"req/s after":>12}')
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        change = (result['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0
+        print(f"{name:>24} {before['p95_ms']:>11} {result['p95_ms']:>10} {change:>+7.1f}% "
+              f"{before['throughput']:>13} {result['throughput']:>12}")
+
+
+def main():
+    args = parse_args()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    if args.database:
+        os.environ['DATABASE_URL'] = args.database
+    else:
+        workdir = tempfile.mkdtemp(prefix='elearning-bench-')
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    import app as app_module
+
+    if not args.database:
+        import datagen
+        datagen.generate(app_module, datagen.parse_args(['--scale', args.scale, '--seed', str(args.seed)]))
+
+    names = args.endpoints.split(',') if args.endpoints else list(ENDPOINTS)
+    unknown = [name for name in names if name not in ENDPOINTS]
+    if unknown:
+        raise SystemExit(f"Unknown endpoints: {', '.join(unknown)}")
+
+    rng = random.Random(args.seed)
+    clients = {role: build_clients(app_module, role, args.threads, rng) for role in ('student', 'teacher')}
+    queries = QueryCounter(app_module)
+
+    print(f'{"endpoint":>24} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"queries":>8} {"5xx":>5}')
+    results = {}
+    for name in names:
+        result = run_endpoint(app_module, queries, clients, ENDPOINTS[name], args.requests, args.threads)
+        results[name] = result
+        print(f"{name:>24} {result['throughput']:>8} {result['p50_ms']:>8} {result['p95_ms']:>8} "
+              f"{result['p99_ms']:>8} {result['queries_mean']:>8} {result['errors']:>5}")
+
+    if args.compare:
+        print_comparison(results, args.compare)
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({
+                'meta': {
+                    'timestamp': datetime.utcnow().isoformat(),
+                    'revision': git_revision(),
+                    'database': os.environ['DATABASE_URL'],
+                    'threads': args.threads,
+                    'requests': args.requests,
+                    'dataset': dataset_counts(app_module),
+                },
+                'endpoints': results,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
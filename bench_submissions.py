@@ -0,0 +1,127 @@
+"""Submission throughput benchmark: per-request commits vs group commit.
+
+Simulates a live quiz burst: every thread logs in as its own student and
+posts answers to /api/submit_quiz as fast as it can. The same burst is
+run with the flush window at 0 (one transaction per submission, the old
+behaviour) and with group commit enabled.
+
+    python bench_submissions.py --students 200 --answers 10 --flush-ms 5
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--students', type=int, default=100, help='concurrent students (one thread each)')
+    parser.add_argument('--answers', type=int, default=10, help='submissions per student')
+    parser.add_argument('--flush-ms', type=float, default=5, help='group commit flush window to compare against')
+    parser.add_argument('--json', dest='json_path', help='also write the results to this file')
+    return parser.parse_args()
+
+
+def seed(app_module, students, quizzes):
+    from werkzeug.security import generate_password_hash
+
+    app, db = app_module.app, app_module.db
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.add_all([
+            app_module.Badge(name=f'Badge {points}', points_required=points) for points in (10, 50, 100, 250, 500)
+        ])
+        teacher = app_module.User(username='bench-teacher', email='bench-teacher@example.com',
+                                  password_hash=generate_password_hash('x', method='pbkdf2:sha256:1'), role='teacher')
+        db.session.add(teacher)
+        db.session.flush()
+        online_class = app_module.OnlineClass(title='Bench', teacher_id=teacher.id, class_code='BENCH1')
+        db.session.add(online_class)
+        db.session.flush()
+        password_hash = generate_password_hash('x', method='pbkdf2:sha256:1')
+        db.session.add_all([
+            app_module.User(username=f'bench{i}', email=f'bench{i}@example.com', password_hash=password_hash, role='student')
+            for i in range(students)
+        ])
+        quiz_rows = [
+            app_module.Quiz(class_id=online_class.id, title=f'Q{i}', question='?', option_a='a', option_b='b',
+                            option_c='c', option_d='d', correct_answer='a', points=10)
+            for i in range(quizzes)
+        ]
+        db.session.add_all(quiz_rows)
+        db.session.commit()
+        app_module.rebuild_rollups()
+        app_module.leaderboard_index.invalidate()
+        return [quiz.id for quiz in quiz_rows]
+
+
+def run_burst(app_module, students, answers, quiz_ids):
+    app = app_module.app
+    clients = []
+    for i in range(students):
+        client = app.test_client()
+        client.post('/login', json={'username': f'bench{i}', 'password': 'x'})
+        clients.append(client)
+
+    errors = []
+    start_line = threading.Barrier(students + 1)
+
+    def student(client, offset):
+        start_line.wait()
+        for n in range(answers):
+            quiz_id = quiz_ids[(offset + n) % len(quiz_ids)]
+            response = client.post('/api/submit_quiz', json={'quiz_id': quiz_id, 'answer': 'a'})
+            if response.status_code != 200:
+                errors.append(response.status_code)
+
+    threads = [threading.Thread(target=student, args=(client, i)) for i, client in enumerate(clients)]
+    for thread in threads:
+        thread.start()
+    start_line.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    total = students * answers
+    return {
+        'submissions': total,
+        'errors': len(errors),
+        'seconds': round(elapsed, 3),
+        'submissions_per_second': round(total / elapsed, 1),
+    }
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix='elearning-bench-')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as app_module
+
+    queue = app_module.submission_queue
+    results = {}
+    for label, flush_ms in (('per_request_commit', 0), ('group_commit', args.flush_ms)):
+        quiz_ids = seed(app_module, args.students, 20)
+        queue.flush_window = flush_ms / 1000
+        batches_before = queue.batches
+        result = run_burst(app_module, args.students, args.answers, quiz_ids)
+        result['flush_ms'] = flush_ms
+        result['transactions'] = queue.batches - batches_before
+        results[label] = result
+        print(f"{label:>20}: {result['submissions_per_second']:>8} submissions/s "
+              f"({result['submissions']} in {result['seconds']}s, {result['transactions']} transactions, "
+              f"{result['errors']} errors)")
+
+    speedup = results['group_commit']['submissions_per_second'] / results['per_request_commit']['submissions_per_second']
+    print(f'{"speedup":>20}: {speedup:.2f}x')
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({'students': args.students, 'answers': args.answers, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
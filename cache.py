@@ -0,0 +1,142 @@
+"""Process-local caches shared across requests."""
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+
+class TTLCache:
+    """Bounded LRU whose entries also expire ``ttl`` seconds after being set."""
+
+    def __init__(self, max_entries=10000, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def update(self, key, func):
+        """Replace a live entry with ``func(value)``; missing entries stay missing."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = (func(entry[0]), entry[1])
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return entry[0] if entry is not None else None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+CachedResponse = namedtuple('CachedResponse', ['body', 'etag'])
+
+
+class ResponseCache:
+    """Serialized response bodies, each stored under the version of a scope.
+
+    An entry is only served while its scope is still at the version it was
+    built from, so write paths call ``bump(scope)`` instead of hunting down
+    keys. Bodies are evicted least recently used once ``max_bytes`` are
+    held, and expire after ``ttl`` seconds so processes that missed a bump
+    converge.
+
+    Versions are drawn from one counter shared by every scope, so comparing a
+    scope's version with :meth:`generation` read earlier tells whether it was
+    bumped since.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, max_entry_bytes=1024 * 1024, ttl=60):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._generation = 0
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def version(self, scope):
+        return self._versions.get(scope, 0)
+
+    def generation(self):
+        return self._generation
+
+    def bump(self, scope):
+        with self._lock:
+            self._generation += 1
+            self._versions[scope] = self._generation
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[2] != self._versions.get(entry[1], 0) or entry[3] <= time.monotonic()):
+                self._discard(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, scope, version, body):
+        """Store ``body`` as built from ``version`` of ``scope`` and return it with its ETag.
+
+        A ``version`` of None returns the body with its ETag without storing it.
+        """
+        response = CachedResponse(body, hashlib.sha1(body).hexdigest())
+        if version is None or len(body) > self.max_entry_bytes:
+            return response
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (response, scope, version, time.monotonic() + self.ttl)
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+                self.evictions += 1
+        return response
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[0].body)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,73 @@
+"""Migration check: the baseline database upgrades to the current schema.
+
+Copies ``elearning.db`` (the database the project started from, created
+before migrations existed) or ``--database`` to a temporary file, runs
+every migration on it and checks that it ends at ``SCHEMA_VERSION`` with
+every table and column of the models, and that a second run applies
+nothing. Meant for CI next to ``check_query_plans.py``:
+
+    python check_migrations.py
+    python check_migrations.py --database /path/to/backup.db
+
+Migrations run against whatever schema the database had, so one that
+reads a column added by a later migration fails here.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', default=os.path.join(HERE, 'elearning.db'),
+                        help='SQLite file to upgrade a copy of (default: the baseline elearning.db)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    sys.path.insert(0, HERE)
+    workdir = tempfile.mkdtemp(prefix='elearning-migrations-')
+    path = os.path.join(workdir, 'migrate.db')
+    shutil.copyfile(args.database, path)
+    os.environ['DATABASE_URL'] = 'sqlite:///' + path
+    os.environ['READ_POOL'] = '0'
+    import app as app_module
+    from migrations import SCHEMA_VERSION, current_version, upgrade
+    from sqlalchemy import inspect
+
+    failures = []
+    with app_module.app.app_context():
+        engine, metadata = app_module.db.engine, app_module.db.metadata
+        with engine.connect() as connection:
+            print(f'Upgrading {args.database} from schema version {current_version(connection)}')
+        for applied in upgrade(engine, metadata):
+            print(f'Applied {applied.version}: {applied.description}')
+        again = upgrade(engine, metadata)
+        if again:
+            failures.append(f'a second upgrade applied {", ".join(str(m.version) for m in again)}')
+        with engine.connect() as connection:
+            version = current_version(connection)
+            if version != SCHEMA_VERSION:
+                failures.append(f'schema version is {version}, expected {SCHEMA_VERSION}')
+            inspector = inspect(connection)
+            for table in metadata.sorted_tables:
+                if not inspector.has_table(table.name):
+                    failures.append(f'table {table.name} is missing')
+                    continue
+                columns = {column['name'] for column in inspector.get_columns(table.name)}
+                failures.extend(f'column {table.name}.{column.name} is missing'
+                                for column in table.columns if column.name not in columns)
+    for failure in failures:
+        print(f'FAIL {failure}')
+    print(f'Schema version {SCHEMA_VERSION}: {len(failures)} problems')
+    shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Query-budget check: every route against its declared SQL budget.
+
+Fills a temporary database with ``datagen.py`` (or uses ``--database``),
+replays each endpoint of ``bench_endpoints.py`` a few times per client and
+fails when a request runs more statements than its view's
+``@query_budget``, repeats one statement shape more than
+``QUERY_BUDGET_REPEAT_LIMIT`` times (the usual sign of an N+1 query) or
+answers with a status its endpoint should not give, as an error page's
+statements say nothing about the route's.
+Meant for CI next to the benchmark:
+
+    python check_query_budgets.py --scale small
+    python check_query_budgets.py --database sqlite:////tmp/elearning-large.db --endpoints class,discussions
+
+Submissions are applied and recommendation snapshots refreshed in the
+request thread so their statements count against the route that caused
+them.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', help='existing database URL to check (default: generate one)')
+    parser.add_argument('--scale', default='small', help='datagen scale when generating a database')
+    parser.add_argument('--clients', type=int, default=3, help='logged in clients per role')
+    parser.add_argument('--requests', type=int, default=3, help='requests per client and endpoint')
+    parser.add_argument('--endpoints', help='comma separated endpoint names to check (default: all)')
+    parser.add_argument('--seed', type=int, default=7)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.environ['SUBMISSION_FLUSH_MS'] = '0'
+    os.environ['RECOMMENDATION_REFRESH_DELAY'] = '0'
+    os.environ['QUERY_BUDGET_MODE'] = 'record'
+    if args.database:
+        os.environ['DATABASE_URL'] = args.database
+    else:
+        workdir = tempfile.mkdtemp(prefix='elearning-budget-')
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'budget.db')
+    import app as app_module
+    from bench_endpoints import ENDPOINTS, Client, add_fresh_activities, build_clients, unexpected_status
+    from querybudget import describe
+
+    if not args.database:
+        import datagen
+        datagen.generate(app_module, datagen.parse_args(['--scale', args.scale, '--seed', str(args.seed)]))
+
+    names = args.endpoints.split(',') if args.endpoints else list(ENDPOINTS)
+    unknown = [name for name in names if name not in ENDPOINTS]
+    if unknown:
+        raise SystemExit(f"Unknown endpoints: {', '.join(unknown)}")
+
+    rng = random.Random(args.seed)
+    clients = {role: build_clients(app_module, role, args.clients, rng) for role in ('student', 'teacher')}
+    clients[None] = [Client(app_module, random.Random(i)) for i in range(args.clients)]
+    add_fresh_activities(app_module, clients['student'])
+    tracker = app_module.query_budgets
+    tracker.peaks.clear()
+    tracker.violations.clear()
+
+    statuses = {}
+    for name in names:
+        role, method, path, body = ENDPOINTS[name]
+        for client in clients[role]:
+            for _ in range(args.requests):
+                url = path(client)
+                response = client.client.open(url, method=method, json=body(client) if body else None)
+                problem = unexpected_status(name, method, url, response)
+                if problem:
+                    statuses.setdefault(name, problem)
+                response.close()
+
+    # One path can map to different views per method, e.g. listing and starting sessions
+    budgets = {(method, rule.rule): tracker.budget_for(rule.endpoint)
+               for rule in app_module.app.url_map.iter_rules() for method in rule.methods}
+    print(f'{"route":>40} {"method":>6} {"peak":>5} {"budget":>6}')
+    for (method, route), peak in sorted(tracker.peaks.items(), key=lambda item: (item[0][1], item[0][0])):
+        budget = budgets.get((method, route))
+        print(f'{route:>40} {method:>6} {peak:>5} {"-" if budget is None else budget:>6}')
+
+    failures = {}
+    for violation in tracker.violations:
+        failures.setdefault((violation.method, violation.route), violation)
+    for violation in failures.values():
+        print('FAIL', describe(violation))
+    for problem in statuses.values():
+        print('FAIL', problem)
+    sys.exit(1 if failures or statuses else 0)
+
+
+if __name__ == '__main__':
+    main()
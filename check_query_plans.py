@@ -0,0 +1,139 @@
+"""Query-plan check: no route may read a large table with a full scan.
+
+Fills a temporary database with ``datagen.py`` (or uses ``--database``),
+replays every endpoint of ``bench_endpoints.py`` and runs ``EXPLAIN QUERY
+PLAN`` on each distinct statement (literals ignored) with the parameters
+it was first seen with. A plan that scans a table instead of searching
+an index fails the check, unless the table is in ``SMALL_TABLES`` or the
+route and table are listed in ``ALLOWED_SCANS``; so does a request that
+answers with a status its endpoint should not give, whose statements are
+not the route's. Meant for CI next to ``check_query_budgets.py``:
+
+    python check_query_plans.py --scale small
+    python check_query_plans.py --database sqlite:////tmp/elearning-large.db --verbose
+
+SQLite only. Submissions and recommendation refreshes run in the request
+thread so their statements are checked against the route that caused
+them.
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import tempfile
+
+# Lookup tables with a handful of rows
+SMALL_TABLES = {'badge', 'schema_version'}
+# (route, table): why reading the whole table is the point of the query
+ALLOWED_SCANS = {
+}
+_SCAN = re.compile(r'^SCAN (\w+)')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', help='existing database URL to check (default: generate one)')
+    parser.add_argument('--scale', default='small', help='datagen scale when generating a database')
+    parser.add_argument('--clients', type=int, default=2, help='logged in clients per role')
+    parser.add_argument('--endpoints', help='comma separated endpoint names to check (default: all)')
+    parser.add_argument('--verbose', action='store_true', help='print the plan of every statement')
+    parser.add_argument('--seed', type=int, default=7)
+    return parser.parse_args()
+
+
+class StatementLog:
+    """The first parameters seen for each statement shape, by route."""
+
+    def __init__(self):
+        self.statements = {}
+
+    def record(self, conn, cursor, statement, parameters, context, executemany):
+        from flask import has_request_context, request
+        from querybudget import fingerprint
+
+        if executemany or not has_request_context() or request.url_rule is None:
+            return
+        if statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE', 'WITH')):
+            self.statements.setdefault((request.url_rule.rule, fingerprint(statement)), (statement, parameters))
+
+
+def scanned_tables(plan, tables):
+    # Subqueries, CTEs and FTS lookups show up as SCAN too; only stored tables count
+    scans = (_SCAN.match(detail) for detail in plan if 'VIRTUAL TABLE' not in detail)
+    return [match.group(1) for match in scans if match and match.group(1) in tables]
+
+
+def main():
+    args = parse_args()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.environ['SUBMISSION_FLUSH_MS'] = '0'
+    os.environ['RECOMMENDATION_REFRESH_DELAY'] = '0'
+    if args.database:
+        os.environ['DATABASE_URL'] = args.database
+    else:
+        workdir = tempfile.mkdtemp(prefix='elearning-plans-')
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'plans.db')
+    import app as app_module
+    from bench_endpoints import ENDPOINTS, Client, add_fresh_activities, build_clients, unexpected_status
+    from sqlalchemy import event
+
+    if not args.database:
+        import datagen
+        datagen.generate(app_module, datagen.parse_args(['--scale', args.scale, '--seed', str(args.seed)]))
+
+    names = args.endpoints.split(',') if args.endpoints else list(ENDPOINTS)
+    unknown = [name for name in names if name not in ENDPOINTS]
+    if unknown:
+        raise SystemExit(f"Unknown endpoints: {', '.join(unknown)}")
+
+    log = StatementLog()
+    with app_module.app.app_context():
+        engines = list(app_module.db.engines.values())
+        if engines[0].dialect.name != 'sqlite':
+            raise SystemExit('Query plans are only checked on SQLite')
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', log.record)
+
+    rng = random.Random(args.seed)
+    clients = {role: build_clients(app_module, role, args.clients, rng) for role in ('student', 'teacher')}
+    clients[None] = [Client(app_module, random.Random(i)) for i in range(args.clients)]
+    add_fresh_activities(app_module, clients['student'])
+    statuses = {}
+    for name in names:
+        role, method, path, body = ENDPOINTS[name]
+        for client in clients[role]:
+            url = path(client)
+            response = client.client.open(url, method=method, json=body(client) if body else None)
+            problem = unexpected_status(name, method, url, response)
+            if problem:
+                statuses.setdefault(name, problem)
+            response.close()
+
+    for problem in statuses.values():
+        print('FAIL', problem)
+    failures = len(statuses)
+
+    connection = engines[0].raw_connection()
+    try:
+        cursor = connection.cursor()
+        tables = {row[0] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        for (route, shape), (statement, parameters) in sorted(log.statements.items()):
+            cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+            plan = [row[3] for row in cursor.fetchall()]
+            scans = [table for table in scanned_tables(plan, tables)
+                     if table not in SMALL_TABLES and (route, table) not in ALLOWED_SCANS]
+            if scans:
+                failures += 1
+                print(f"FAIL {route}: scans {', '.join(scans)}\n    {shape[:240]}")
+            if scans or args.verbose:
+                for detail in plan:
+                    print(f'    | {detail}')
+    finally:
+        connection.close()
+    print(f'{len(log.statements)} statements checked, {failures} failures')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Race check: a submission that loses its unique index answers 400, not 500.
+
+Submissions are checked against earlier ones before they are written, but
+two from the same student can both pass that check; the unique indexes
+then let one in and fail the other with an IntegrityError. This check
+forces the race on a fresh database: just before each poll vote,
+challenge completion or multi-question quiz sheet is inserted, a rival
+row for the same student is inserted on the same connection, as a
+concurrent submission that passed the same check would have done. It
+submits the contested item alone and in a group with another item, and
+expects the duplicate answer for it and success for the other:
+
+    python check_submission_races.py
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# table -> rival row, inserted before the table's next INSERT while armed
+RIVALS = {
+    'poll_response': 'INSERT INTO poll_response (poll_id, user_id, selected_option, points_earned) '
+                     'VALUES (?, ?, 1, 0)',
+    'challenge_response': 'INSERT INTO challenge_response (challenge_id, user_id, submission, points_earned, '
+                          'is_completed) VALUES (?, ?, \'rival\', 0, 1)',
+    'quiz_response': 'INSERT INTO quiz_response (quiz_id, user_id, answer, answers, is_correct, points_earned) '
+                     'VALUES (?, ?, \'\', \'--\', 0, 0)',
+}
+
+
+def main():
+    sys.path.insert(0, HERE)
+    workdir = tempfile.mkdtemp(prefix='elearning-races-')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'races.db')
+    os.environ['READ_POOL'] = '0'
+    import app as app_module
+    from sqlalchemy import event
+
+    armed = {}
+
+    def insert_rival(conn, cursor, statement, parameters, context, executemany):
+        table = armed.get('table')
+        if table and statement.startswith(f'INSERT INTO {table} '):
+            cursor.execute(RIVALS[table], armed['row'])
+
+    with app_module.app.app_context():
+        app_module.init_db()
+        event.listen(app_module.db.engine, 'before_cursor_execute', insert_rival)
+        users = {user.username: user.id for user in app_module.User.query}
+        class_id = app_module.OnlineClass.query.first().id
+
+    def login(username, password):
+        client = app_module.app.test_client()
+        client.post('/login', json={'username': username, 'password': password})
+        return client
+
+    teacher = login('teacher1', 'teacher123')
+    sheet = teacher.post('/api/create_quiz', json={'class_id': class_id, 'title': 'Race', 'points': 5, 'questions': [
+        {'question': 'One?', 'options': ['a', 'b'], 'correct_answer': 'a'},
+        {'question': 'Two?', 'options': ['a', 'b'], 'correct_answer': 'b'},
+    ]}).get_json()['quiz_id']
+
+    # (kind, table, activity id, endpoint, body, duplicate answer, another item for the group)
+    cases = [
+        ('poll', 'poll_response', 1, '/api/submit_poll', {'poll_id': 1, 'selected_option': 2},
+         'Already responded to this poll', {'type': 'quiz', 'quiz_id': 1, 'answer': 'a'}),
+        ('challenge', 'challenge_response', 1, '/api/submit_challenge', {'challenge_id': 1, 'submission': 'Done'},
+         'Challenge already completed', {'type': 'quiz', 'quiz_id': 1, 'answer': 'a'}),
+        ('quiz', 'quiz_response', sheet, '/api/submit_quiz', {'quiz_id': sheet, 'answers': ['a', 'b']},
+         'Quiz already submitted', {'type': 'poll', 'poll_id': 2, 'selected_option': 1}),
+    ]
+    failures = []
+    for kind, table, activity_id, endpoint, body, duplicate, other in cases:
+        for username, grouped in (('student1', False), ('student2', True)):
+            client = login(username, 'student123')
+            armed.update(table=table, row=(activity_id, users[username]))
+            if grouped:
+                response = client.post('/api/submit_batch',
+                                       json={'submissions': [dict(body, type=kind), other]})
+                results = response.get_json()['results']
+                got = [(result['status'], result.get('error')) for result in results]
+                expected = [(400, duplicate), (200, None)]
+            else:
+                response = client.post(endpoint, json=body)
+                got = [(response.status_code, response.get_json().get('error'))]
+                expected = [(400, duplicate)]
+            armed.clear()
+            label = f'{kind} {"in a group" if grouped else "alone"}'
+            print(f'{label:>20}: {got}')
+            if got != expected:
+                failures.append(f'{label}: expected {expected}, got {got}')
+
+    for failure in failures:
+        print(f'FAIL {failure}')
+    print(f'{len(cases) * 2} races: {len(failures)} problems')
+    shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""Configuration profiles.
+
+The storage profile is picked with ``ELEARNING_STORAGE`` (``sqlite-wal``
+by default) and the database with ``DATABASE_URL``, so the same models
+can run on the bundled SQLite file or a local PostgreSQL stand-in.
+"""
+import os
+
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def env_float(name, default):
+    return float(os.environ.get(name, default))
+
+
+class Config:
+    """SQLAlchemy defaults: rollback journal, default pool, no read pool."""
+
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production')
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///elearning.db')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+
+    # PRAGMAs run on every new SQLite connection
+    SQLITE_PRAGMAS = {}
+    # Route the SELECTs of GET/HEAD requests to a separate connection pool
+    READ_POOL = False
+    READ_DATABASE_URL = os.environ.get('READ_DATABASE_URL')
+    # Password hashing: Werkzeug method for new hashes, worker processes (0 hashes
+    # in the request thread), operations queued before 503, and seconds to wait
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    PASSWORD_WORKERS = env_int('PASSWORD_WORKERS', 2)
+    PASSWORD_QUEUE_SIZE = env_int('PASSWORD_QUEUE_SIZE', 32)
+    PASSWORD_TIMEOUT = env_float('PASSWORD_TIMEOUT', 10)
+    # Retries for writes that fail with "database is locked"
+    DB_LOCK_RETRIES = env_int('DB_LOCK_RETRIES', 3)
+    DB_LOCK_RETRY_DELAY = env_float('DB_LOCK_RETRY_DELAY', 0.05)
+
+    # Cross-request cache of user id -> role, points and class ids
+    IDENTITY_CACHE_SIZE = env_int('IDENTITY_CACHE_SIZE', 50000)
+    IDENTITY_CACHE_TTL = env_int('IDENTITY_CACHE_TTL', 30)
+    # Serialized class, quiz, poll and challenge responses, dropped when their class changes
+    RESPONSE_CACHE_MAX_BYTES = env_int('RESPONSE_CACHE_MAX_BYTES', 32 * 1024 * 1024)
+    RESPONSE_CACHE_MAX_ENTRY_BYTES = env_int('RESPONSE_CACHE_MAX_ENTRY_BYTES', 1024 * 1024)
+    RESPONSE_CACHE_TTL = env_int('RESPONSE_CACHE_TTL', 60)
+    # Badge thresholds are reloaded this often, for badges changed outside this process
+    BADGE_CATALOG_TTL = env_int('BADGE_CATALOG_TTL', 60)
+
+    LEADERBOARD_REFRESH_SECONDS = env_int('LEADERBOARD_REFRESH_SECONDS', 300)
+    # Submissions arriving within the flush window are committed together; 0 commits each one inline
+    SUBMISSION_FLUSH_MS = env_float('SUBMISSION_FLUSH_MS', 5)
+    SUBMISSION_QUEUE_SIZE = env_int('SUBMISSION_QUEUE_SIZE', 2000)
+    SUBMISSION_MAX_BATCH = env_int('SUBMISSION_MAX_BATCH', 200)
+    SUBMISSION_TIMEOUT = env_float('SUBMISSION_TIMEOUT', 10)
+
+    # Server-Sent Events: undelivered events kept per connection, and keepalive interval
+    EVENT_QUEUE_SIZE = env_int('EVENT_QUEUE_SIZE', 100)
+    EVENT_HEARTBEAT_SECONDS = env_int('EVENT_HEARTBEAT_SECONDS', 25)
+    # Each open stream holds a server thread: past this many per process (0: no limit)
+    # new ones answer 503 and clients poll instead
+    EVENT_MAX_STREAMS = env_int('EVENT_MAX_STREAMS', 0)
+    # Events only reach streams held by the worker that published them, so with
+    # several workers connected dashboards also re-fetch on this interval; 0 never
+    LIVE_REFRESH_SECONDS = env_int('LIVE_REFRESH_SECONDS', 30 if env_int('WEB_CONCURRENCY', 1) > 1 else 0)
+    # While that is on, open poll results streams re-read their counts this often
+    POLL_RESULTS_REFRESH_SECONDS = env_float('POLL_RESULTS_REFRESH_SECONDS', 2)
+    POLL_TALLY_CACHE_SIZE = env_int('POLL_TALLY_CACHE_SIZE', 10000)
+    # Recommendation snapshots are recomputed this long after their first change; 0 recomputes inline
+    RECOMMENDATION_REFRESH_DELAY = env_float('RECOMMENDATION_REFRESH_DELAY', 1.0)
+    RECOMMENDATION_REFRESH_BATCH = env_int('RECOMMENDATION_REFRESH_BATCH', 500)
+    # Ledger rows older than this are folded into daily totals by compact-points
+    POINTS_LEDGER_RETAIN_DAYS = env_int('POINTS_LEDGER_RETAIN_DAYS', 90)
+    # Bulk activity imports: rows per transaction, and per-line errors returned in full
+    IMPORT_CHUNK_SIZE = env_int('IMPORT_CHUNK_SIZE', 500)
+    IMPORT_MAX_ERRORS = env_int('IMPORT_MAX_ERRORS', 1000)
+    # Students per set of gradebook queries while streaming an export
+    GRADEBOOK_PAGE_SIZE = env_int('GRADEBOOK_PAGE_SIZE', 500)
+    # Challenge due dates and recurrences: jobs due this far ahead are held in memory, and
+    # students are told about a challenge this many hours before it closes
+    SCHEDULER_ENABLED = bool(env_int('SCHEDULER_ENABLED', 1))
+    SCHEDULER_HORIZON_SECONDS = env_int('SCHEDULER_HORIZON_SECONDS', 60)
+    SCHEDULER_BATCH = env_int('SCHEDULER_BATCH', 1000)
+    CHALLENGE_DUE_SOON_HOURS = env_int('CHALLENGE_DUE_SOON_HOURS', 24)
+    # Attendance rates look at a class's latest sessions; below the minimum rate a student is a chronic absentee
+    ATTENDANCE_WINDOW = env_int('ATTENDANCE_WINDOW', 10)
+    ATTENDANCE_MIN_RATE = env_float('ATTENDANCE_MIN_RATE', 0.5)
+
+    # Prometheus metrics at /metrics; a sampled share of requests is logged with its SQL when slow
+    METRICS_ENABLED = bool(env_int('METRICS_ENABLED', 1))
+    SLOW_REQUEST_MS = env_float('SLOW_REQUEST_MS', 1000)
+    SLOW_REQUEST_SAMPLE_RATE = env_float('SLOW_REQUEST_SAMPLE_RATE', 0)
+    # Per-request SQL budgets: off, warn (log), raise (fail the request) or record
+    QUERY_BUDGET_MODE = os.environ.get('QUERY_BUDGET_MODE', 'off')
+    QUERY_BUDGET_REPEAT_LIMIT = env_int('QUERY_BUDGET_REPEAT_LIMIT', 2)
+
+
+class SQLiteWALConfig(Config):
+    """WAL journaling so readers never wait for the submit/attendance writers."""
+
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': env_int('DB_POOL_SIZE', 10),
+        'max_overflow': env_int('DB_MAX_OVERFLOW', 20),
+        'pool_timeout': 30,
+        # sqlite3 busy handler, in seconds
+        'connect_args': {'timeout': env_float('DB_BUSY_TIMEOUT_MS', 5000) / 1000},
+    }
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': env_int('DB_BUSY_TIMEOUT_MS', 5000),
+        'mmap_size': env_int('DB_MMAP_SIZE', 256 * 1024 * 1024),
+        # Negative values are KiB rather than pages
+        'cache_size': -env_int('DB_CACHE_KIB', 64 * 1024),
+        'temp_store': 'MEMORY',
+    }
+    READ_POOL = os.environ.get('READ_POOL', '1') == '1'
+
+
+class PostgresConfig(Config):
+    """Pooled connections for a PostgreSQL ``DATABASE_URL``."""
+
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': env_int('DB_POOL_SIZE', 10),
+        'max_overflow': env_int('DB_MAX_OVERFLOW', 20),
+        'pool_timeout': 30,
+        'pool_pre_ping': True,
+    }
+    READ_POOL = os.environ.get('READ_POOL', '0') == '1'
+
+
+STORAGE_PROFILES = {
+    'default': Config,
+    'sqlite-wal': SQLiteWALConfig,
+    'postgres': PostgresConfig,
+}
+
+
+def storage_profile(name=None):
+    name = name or os.environ.get('ELEARNING_STORAGE', 'sqlite-wal')
+    try:
+        return STORAGE_PROFILES[name]
+    except KeyError:
+        raise ValueError(f'Unknown storage profile {name!r}, expected one of {sorted(STORAGE_PROFILES)}')
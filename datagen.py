@@ -0,0 +1,310 @@
+"""Synthetic data generator for load and query-plan testing.
+
+Runs the regular ``init_db`` seeding (badges, the sample teacher, students
+and WEB101 class) and then bulk-inserts a synthetic school on top of it:
+teachers, classes, enrolled students, class sessions with attendance,
+quizzes (every fifth one a multi-question test), polls and challenges,
+responses to them and nested discussion threads. Rows are written with Core ``executemany`` inserts in chunks, so
+tens of millions of responses stream through a bounded amount of memory.
+
+    python datagen.py --scale large --database sqlite:////tmp/elearning-large.db
+    python datagen.py --students 5000 --classes 200 --responses 500000
+
+Generated users are named ``gen-student<N>`` / ``gen-teacher<N>`` and log
+in with ``student123`` / ``teacher123``, like the sample accounts.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+SCALES = {
+    'small': {'students': 1000, 'teachers': 20, 'classes': 50, 'responses': 100_000, 'posts': 5_000},
+    'medium': {'students': 10_000, 'teachers': 200, 'classes': 500, 'responses': 1_000_000, 'posts': 50_000},
+    'large': {'students': 50_000, 'teachers': 500, 'classes': 2_000, 'responses': 10_000_000, 'posts': 250_000},
+}
+
+STUDENT_PASSWORD = 'student123'
+TEACHER_PASSWORD = 'teacher123'
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small', help='preset sizes; the options below override it')
+    parser.add_argument('--database', help='database URL to fill (default: DATABASE_URL or the app default)')
+    parser.add_argument('--students', type=int)
+    parser.add_argument('--teachers', type=int)
+    parser.add_argument('--classes', type=int)
+    parser.add_argument('--responses', type=int, help='quiz, poll and challenge responses in total')
+    parser.add_argument('--posts', type=int, help='discussion posts in total')
+    parser.add_argument('--classes-per-student', type=int, default=3)
+    parser.add_argument('--activities-per-class', type=int, default=10, help='quizzes, polls and challenges each')
+    parser.add_argument('--questions-per-test', type=int, default=10,
+                        help='questions of the multi-question quizzes, every fifth quiz of a class')
+    parser.add_argument('--sessions-per-class', type=int, default=20, help='class sessions with attendance')
+    parser.add_argument('--thread-depth', type=int, default=6, help='deepest reply chain in a discussion thread')
+    parser.add_argument('--days', type=int, default=120, help='spread timestamps over this many days')
+    parser.add_argument('--chunk', type=int, default=20_000, help='rows per insert statement batch')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+    if args.teachers is not None and args.teachers < 1 or args.classes is not None and args.classes < 1:
+        parser.error('--teachers and --classes must be at least 1')
+    for name, value in SCALES[args.scale].items():
+        if getattr(args, name) is None:
+            setattr(args, name, value)
+    return args
+
+
+class Loader:
+    """Chunked bulk inserts with progress output."""
+
+    def __init__(self, db, chunk):
+        self.db = db
+        self.chunk = chunk
+
+    def next_id(self, model):
+        return (self.db.session.query(self.db.func.max(model.id)).scalar() or 0) + 1
+
+    def insert(self, model, rows):
+        table = model.__table__
+        started = time.perf_counter()
+        count = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.chunk:
+                self.db.session.execute(table.insert(), batch)
+                self.db.session.commit()
+                count += len(batch)
+                batch = []
+        if batch:
+            self.db.session.execute(table.insert(), batch)
+            self.db.session.commit()
+            count += len(batch)
+        elapsed = time.perf_counter() - started
+        print(f'{table.name:>20}: {count:>10} rows in {elapsed:7.1f}s ({count / elapsed if elapsed else 0:,.0f} rows/s)')
+        return count
+
+
+def generate(app_module, args):
+    from werkzeug.security import generate_password_hash
+
+    rng = random.Random(args.seed)
+    app, db = app_module.app, app_module.db
+    now = datetime.utcnow()
+
+    def timestamp(after=None):
+        start = after or now - timedelta(days=args.days)
+        return start + (now - start) * rng.random()
+
+    app_module.init_db()
+    with app.app_context():
+        loader = Loader(db, args.chunk)
+        student_hash = generate_password_hash(STUDENT_PASSWORD)
+        teacher_hash = generate_password_hash(TEACHER_PASSWORD)
+
+        first_user = loader.next_id(app_module.User)
+        teacher_ids = list(range(first_user, first_user + args.teachers))
+        student_ids = list(range(first_user + args.teachers, first_user + args.teachers + args.students))
+        loader.insert(app_module.User, (
+            {'id': user_id, 'username': f'gen-teacher{n}', 'email': f'gen-teacher{n}@example.com',
+             'password_hash': teacher_hash, 'role': 'teacher', 'points': 0, 'created_at': timestamp()}
+            for n, user_id in enumerate(teacher_ids)
+        ))
+        loader.insert(app_module.User, (
+            {'id': user_id, 'username': f'gen-student{n}', 'email': f'gen-student{n}@example.com',
+             'password_hash': student_hash, 'role': 'student', 'points': 0, 'created_at': timestamp()}
+            for n, user_id in enumerate(student_ids)
+        ))
+
+        first_class = loader.next_id(app_module.OnlineClass)
+        class_ids = list(range(first_class, first_class + args.classes))
+        class_created = {class_id: timestamp() for class_id in class_ids}
+        loader.insert(app_module.OnlineClass, (
+            {'id': class_id, 'title': f'Generated Class {n}', 'description': f'Synthetic class {n}',
+             'teacher_id': teacher_ids[n % len(teacher_ids)], 'class_code': f'GEN{class_id:07d}',
+             'created_at': class_created[class_id], 'is_active': True}
+            for n, class_id in enumerate(class_ids)
+        ))
+
+        # Enrollments: every student joins a few classes, skewed toward popular ones
+        enrollments = []
+        weights = [1 / (rank + 1) ** 0.5 for rank in range(len(class_ids))]
+        for user_id in student_ids:
+            chosen = set()
+            while len(chosen) < min(args.classes_per_student, len(class_ids)):
+                chosen.add(rng.choices(class_ids, weights)[0])
+            enrollments.extend((user_id, class_id) for class_id in sorted(chosen))
+        roster = {class_id: [] for class_id in class_ids}
+        for user_id, class_id in enrollments:
+            roster[class_id].append(user_id)
+
+        # Sessions: every student keeps a habit, so some classes have chronic absentees
+        habit = {user_id: rng.uniform(0.3, 1.0) for user_id in student_ids}
+        attended = dict.fromkeys(enrollments, 0)
+        session_rows = []
+        for class_id, members in roster.items():
+            start = class_created[class_id]
+            for n in range(args.sessions_per_class):
+                bits = 0
+                for ordinal, user_id in enumerate(members):
+                    if rng.random() < habit[user_id]:
+                        bits |= 1 << ordinal
+                        attended[user_id, class_id] += 1
+                session_rows.append({'class_id': class_id, 'title': f'Session {n + 1}',
+                                     'started_at': start + (now - start) * (n + 1) / (args.sessions_per_class + 1),
+                                     'roster_size': len(members), 'headcount': bits.bit_count(),
+                                     'attendance': app_module.attendance.encode(bits)})
+        loader.insert(app_module.ClassEnrollment, (
+            {'user_id': user_id, 'class_id': class_id, 'ordinal': ordinal,
+             'enrolled_at': timestamp(class_created[class_id]), 'attendance_count': attended[user_id, class_id]}
+            for class_id, members in roster.items() for ordinal, user_id in enumerate(members)
+        ))
+        loader.insert(app_module.ClassSession, session_rows)
+        del session_rows
+
+        # Activities, with a per-quiz difficulty so some quizzes are weak spots
+        activities = {'quiz': {}, 'poll': {}, 'challenge': {}}
+        difficulty = {}
+        quiz_rows, poll_rows, challenge_rows, job_rows = [], [], [], []
+        next_ids = {kind: loader.next_id(model) for kind, model in
+                    (('quiz', app_module.Quiz), ('poll', app_module.Poll), ('challenge', app_module.Challenge))}
+        for class_id in class_ids:
+            for kind in activities:
+                ids = list(range(next_ids[kind], next_ids[kind] + args.activities_per_class))
+                next_ids[kind] += args.activities_per_class
+                activities[kind][class_id] = ids
+            for n, quiz_id in enumerate(activities['quiz'][class_id]):
+                difficulty[quiz_id] = rng.uniform(0.2, 0.95)
+                if n % 5 == 4 and args.questions_per_test > 1:
+                    key = ''.join(rng.choice('abcd') for _ in range(args.questions_per_test))
+                    questions, _ = app_module.grading.parse_questions([
+                        {'question': f'Question {quiz_id}.{position}?', 'options': ['A', 'B', 'C', 'D'], 'correct_answer': letter}
+                        for position, letter in enumerate(key)])
+                    quiz_rows.append({'id': quiz_id, 'class_id': class_id, 'title': f'Test {n}',
+                                      'question': f'Question {quiz_id}.0?', 'option_a': '', 'option_b': '', 'option_c': '',
+                                      'option_d': '', 'correct_answer': '', 'questions': questions, 'answer_key': key,
+                                      'question_count': len(key), 'points': 10,
+                                      'created_at': timestamp(class_created[class_id])})
+                    continue
+                quiz_rows.append({'id': quiz_id, 'class_id': class_id, 'title': f'Quiz {n}', 'question': f'Question {quiz_id}?',
+                                  'option_a': 'A', 'option_b': 'B', 'option_c': 'C', 'option_d': 'D',
+                                  'correct_answer': rng.choice('abcd'), 'points': 10,
+                                  'created_at': timestamp(class_created[class_id]), 'questions': None,
+                                  'answer_key': None, 'question_count': 1})
+            for n, poll_id in enumerate(activities['poll'][class_id]):
+                poll_rows.append({'id': poll_id, 'class_id': class_id, 'question': f'Poll {n}?',
+                                  'option_1': 'One', 'option_2': 'Two', 'option_3': 'Three', 'option_4': 'Four',
+                                  'points': 5, 'created_at': timestamp(class_created[class_id])})
+            for n, challenge_id in enumerate(activities['challenge'][class_id]):
+                challenge_type = rng.choice(('quick', 'daily', 'weekly'))
+                # Open challenges, due within their period (a fortnight for quick ones)
+                due_date = now + app_module.PERIODS.get(challenge_type, timedelta(weeks=2)) * rng.random()
+                challenge_rows.append({'id': challenge_id, 'class_id': class_id, 'title': f'Challenge {n}',
+                                       'description': 'Synthetic challenge', 'challenge_type': challenge_type,
+                                       'points': 20, 'created_at': timestamp(class_created[class_id]),
+                                       'due_date': due_date})
+                job_rows.append({'kind': 'close_challenge', 'target_id': challenge_id, 'run_at': due_date})
+        correct_answers = {row['id']: row['answer_key'] or row['correct_answer'] for row in quiz_rows}
+        loader.insert(app_module.Quiz, quiz_rows)
+        loader.insert(app_module.Poll, poll_rows)
+        loader.insert(app_module.Challenge, challenge_rows)
+        loader.insert(app_module.ScheduledJob, job_rows)
+        del quiz_rows, poll_rows, challenge_rows, job_rows
+
+        # Responses: each enrollment answers a sample of its class's activities,
+        # which keeps (user, activity) pairs unique without remembering them
+        points = dict.fromkeys(student_ids, 0)
+        per_enrollment = args.responses / len(enrollments) if enrollments else 0
+        shares = {'quiz': 0.5, 'poll': 0.3, 'challenge': 0.2}
+
+        def responses(kind):
+            for user_id, class_id in enrollments:
+                available = activities[kind][class_id]
+                wanted = per_enrollment * shares[kind]
+                count = min(len(available), int(wanted) + (rng.random() < wanted % 1))
+                for activity_id in rng.sample(available, count):
+                    responded_at = timestamp()
+                    if kind == 'quiz':
+                        # One letter per question, each right with the quiz's difficulty
+                        sheet = ''.join(letter if rng.random() < difficulty[activity_id]
+                                        else rng.choice([c for c in 'abcd' if c != letter])
+                                        for letter in correct_answers[activity_id])
+                        grade = app_module.grading.answer_key(correct_answers[activity_id]).grade(sheet)
+                        is_correct = grade.score == len(sheet)
+                        points[user_id] += 10 * grade.score
+                        yield {'quiz_id': activity_id, 'user_id': user_id, 'answer': sheet if len(sheet) == 1 else '',
+                               'answers': sheet if len(sheet) > 1 else None,
+                               'results': app_module.grading.pack_results(grade.results, len(sheet)) if len(sheet) > 1 else None,
+                               'is_correct': is_correct, 'points_earned': 10 * grade.score, 'responded_at': responded_at}
+                    elif kind == 'poll':
+                        points[user_id] += 5
+                        yield {'poll_id': activity_id, 'user_id': user_id, 'selected_option': rng.randint(1, 4),
+                               'points_earned': 5, 'responded_at': responded_at}
+                    else:
+                        points[user_id] += 20
+                        yield {'challenge_id': activity_id, 'user_id': user_id, 'submission': 'Generated',
+                               'points_earned': 20, 'submitted_at': responded_at, 'is_completed': True}
+
+        loader.insert(app_module.QuizResponse, responses('quiz'))
+        loader.insert(app_module.PollResponse, responses('poll'))
+        loader.insert(app_module.ChallengeResponse, responses('challenge'))
+
+        # Discussions: threads whose reply chains go up to --thread-depth deep
+        members = {}
+        for user_id, class_id in enrollments:
+            members.setdefault(class_id, []).append(user_id)
+
+        def posts():
+            post_id = loader.next_id(app_module.DiscussionPost)
+            remaining = args.posts
+            busy_classes = sorted(members)
+            while remaining > 0 and busy_classes:
+                class_id = rng.choice(busy_classes)
+                authors = members[class_id]
+                # (post_id, depth) of every post in the thread; None is the class board itself
+                thread = [(None, 0)]
+                created_at = timestamp(class_created[class_id])
+                for _ in range(min(remaining, rng.randint(1, 3 * args.thread_depth))):
+                    # Mostly continue the newest reply chain, sometimes branch off an earlier post
+                    parent_id, depth = thread[-1] if rng.random() < 0.6 else rng.choice(thread)
+                    if depth >= args.thread_depth:
+                        parent_id, depth = thread[0]
+                    yield {'id': post_id, 'class_id': class_id, 'user_id': rng.choice(authors),
+                           'content': f'Post {post_id}', 'created_at': created_at, 'parent_id': parent_id}
+                    thread.append((post_id, depth + 1))
+                    created_at = timestamp(created_at)
+                    post_id += 1
+                    remaining -= 1
+
+        loader.insert(app_module.DiscussionPost, posts())
+
+        started = time.perf_counter()
+        users = app_module.User.__table__
+        update = users.update().where(users.c.id == db.bindparam('target_id')).values(points=db.bindparam('new_points'))
+        items = [{'target_id': user_id, 'new_points': value} for user_id, value in points.items() if value]
+        for start in range(0, len(items), args.chunk):
+            db.session.execute(update, items[start:start + args.chunk])
+        db.session.commit()
+        app_module.rebuild_points_ledger()
+        awarded = app_module.backfill_badges()
+        app_module.rebuild_rollups()
+        print(f'{"points/badges/rollups":>20}: {awarded} badges awarded in {time.perf_counter() - started:.1f}s')
+
+
+def main():
+    args = parse_args()
+    if args.database:
+        os.environ['DATABASE_URL'] = args.database
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as app_module
+
+    started = time.perf_counter()
+    generate(app_module, args)
+    print(f'Done in {time.perf_counter() - started:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
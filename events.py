@@ -0,0 +1,130 @@
+"""In-process publish/subscribe hub for the Server-Sent Events stream.
+
+Every open ``/api/events`` connection holds one :class:`Subscription`,
+registered on a set of channels such as ``user:12`` and ``class:3``.
+Write endpoints publish to channels after they commit; idle subscribers
+cost one blocked thread and no CPU. The hub only reaches connections
+held by the same process, and holds at most ``max_streams`` of them so
+streams never take every thread ordinary requests need.
+"""
+import json
+import queue
+import threading
+from collections import defaultdict
+
+
+class Subscription:
+    def __init__(self, channels, max_pending):
+        self.channels = set(channels)
+        self._queue = queue.Queue(maxsize=max_pending)
+        self.overflowed = False
+
+    def push(self, event, data):
+        try:
+            self._queue.put_nowait((event, data))
+        except queue.Full:
+            # A client this far behind re-fetches its state instead
+            self.overflowed = True
+
+    def get(self, timeout):
+        """Next ``(event, data)`` pair, or ``None`` after ``timeout`` seconds."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class StreamLimitReached(Exception):
+    """Raised by :meth:`EventHub.subscribe` while ``max_streams`` subscriptions are open."""
+
+
+class EventHub:
+    def __init__(self, max_pending=100, max_streams=0):
+        self.max_pending = max_pending
+        self.max_streams = max_streams  # 0: no limit
+        self._channels = defaultdict(set)
+        self._open = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, channels):
+        subscription = Subscription(channels, self.max_pending)
+        with self._lock:
+            if self.max_streams and len(self._open) >= self.max_streams:
+                raise StreamLimitReached(f'{self.max_streams} streams are open')
+            self._open.add(subscription)
+            for channel in subscription.channels:
+                self._channels[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Safe to call more than once, and for a stream that never started."""
+        with self._lock:
+            self._open.discard(subscription)
+            for channel in subscription.channels:
+                subscribers = self._channels.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._channels[channel]
+
+    def extend(self, channel, new_channel):
+        """Also deliver ``new_channel`` to every subscriber of ``channel``."""
+        with self._lock:
+            for subscription in list(self._channels.get(channel, ())):
+                subscription.channels.add(new_channel)
+                self._channels[new_channel].add(subscription)
+
+    def publish(self, channel, event, data):
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+        for subscription in subscribers:
+            subscription.push(event, data)
+        return len(subscribers)
+
+    def has_subscribers(self, channel):
+        with self._lock:
+            return bool(self._channels.get(channel))
+
+    def connection_count(self):
+        with self._lock:
+            return len(self._open)
+
+
+def format_sse(event, data):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+def stream(hub, subscription, heartbeat=25, initial=(), refresh=None, refresh_seconds=0):
+    """Generator of SSE frames for ``subscription``; unsubscribes on disconnect.
+
+    ``initial`` is a sequence of ``(event, data)`` pairs sent before any
+    published event.
+
+    ``refresh`` is for state other processes change too: it returns the
+    current ``(event, data)`` pair, or None if that has not changed since it
+    last returned one. It is called instead of sending each published event,
+    which then only says the state changed, and every ``refresh_seconds``.
+    """
+    timeout = min(heartbeat, refresh_seconds) if refresh is not None and refresh_seconds > 0 else heartbeat
+    idle = 0
+    try:
+        yield 'retry: 5000\n\n'
+        for event, data in initial:
+            yield format_sse(event, data)
+        while True:
+            message = subscription.get(timeout=timeout)
+            if subscription.overflowed:
+                subscription.overflowed = False
+                yield format_sse('resync', {})
+            if refresh is not None and (message is not None or timeout < heartbeat):
+                message = refresh()
+            if message is not None:
+                idle = 0
+                yield format_sse(*message)
+                continue
+            idle += timeout
+            if idle >= heartbeat:
+                idle = 0
+                yield ': keepalive\n\n'
+    finally:
+        hub.unsubscribe(subscription)
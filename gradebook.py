@@ -0,0 +1,50 @@
+"""Streaming CSV and JSON encoders for class gradebooks.
+
+Rows arrive from a generator and are written out in ~64 KiB pieces, so a
+gradebook of any size is never held as one document. Each row has the
+per-student summary columns plus ``grades``, one cell per activity in the
+order of the activity list: 1/0 for a correct/incorrect quiz, 1 for a
+poll answered or challenge completed, None when there is no response.
+"""
+import csv
+import io
+import json
+
+SUMMARY_COLUMNS = ('user_id', 'username', 'attendance', 'points', 'quizzes_correct', 'quizzes_answered',
+                   'polls_answered', 'challenges_completed')
+FLUSH_BYTES = 64 * 1024
+
+
+def _cell(value):
+    # Keep spreadsheet apps from evaluating titles and usernames as formulas
+    if isinstance(value, str) and value[:1] in ('=', '+', '-', '@'):
+        return "'" + value
+    return '' if value is None else value
+
+
+def iter_csv(activities, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(SUMMARY_COLUMNS + tuple(_cell(f"{a['type']} {a['id']}: {a['title']}") for a in activities))
+    for row in rows:
+        writer.writerow([_cell(row[column]) for column in SUMMARY_COLUMNS] + [_cell(grade) for grade in row['grades']])
+        if buffer.tell() >= FLUSH_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_json(head, rows):
+    """``head`` (a dict) with a ``students`` list appended from ``rows``."""
+    opening = json.dumps(head)
+    pieces, size = [opening[:-1] + (', ' if head else '') + '"students": ['], 0
+    for index, row in enumerate(rows):
+        piece = (', ' if index else '') + json.dumps(row)
+        pieces.append(piece)
+        size += len(piece)
+        if size >= FLUSH_BYTES:
+            yield ''.join(pieces)
+            pieces, size = [], 0
+    pieces.append(']}')
+    yield ''.join(pieces)
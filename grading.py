@@ -0,0 +1,108 @@
+"""Multi-question quizzes: serialized question lists and whole-sheet grading.
+
+A multi-question quiz stores its questions as one compact JSON list,
+``[[question, [option, ...]], ...]`` in order, and its answer key apart
+from them as a string with one letter per question (``'acbd...'``), so
+the questions can be served without the answers. A student's answer
+sheet is a string of the same length, ``-`` for a blank.
+
+Grading packs the key and the sheet one byte per question into two ints
+and compares every question at once: an XOR leaves a zero byte where the
+answers match, a carry-free byte test turns each zero byte into a set
+bit, and the result is a bitmap with bit ``i`` set for a correct answer
+to question ``i``. Keys are compiled once and cached by their letters.
+"""
+import functools
+import json
+from collections import namedtuple
+
+LETTERS = 'abcd'
+BLANK = '-'
+MAX_QUESTIONS = 200
+MAX_TEXT = 1000
+
+Grade = namedtuple('Grade', ['results', 'score'])
+
+# Byte 0/1 -> ASCII digit, for turning one byte per question into one bit
+_DIGITS = bytes.maketrans(b'\x00\x01', b'01')
+
+
+def parse_questions(questions):
+    """Serialized questions and answer key from a list of question dicts.
+
+    Each question is ``{"question": str, "options": [2-4 str], "correct_answer": letter}``.
+    Raises ValueError with a message for the client.
+    """
+    if not isinstance(questions, list) or not 1 <= len(questions) <= MAX_QUESTIONS:
+        raise ValueError(f'questions must be a list of 1 to {MAX_QUESTIONS} questions')
+    serialized, key = [], []
+    for number, question in enumerate(questions, 1):
+        if not isinstance(question, dict):
+            raise ValueError(f'question {number} must be an object')
+        text, options = question.get('question'), question.get('options')
+        if not isinstance(text, str) or not text.strip() or len(text) > MAX_TEXT:
+            raise ValueError(f'question {number} needs question text of at most {MAX_TEXT} characters')
+        if (not isinstance(options, list) or not 2 <= len(options) <= len(LETTERS)
+                or not all(isinstance(option, str) and option.strip() and len(option) <= MAX_TEXT for option in options)):
+            raise ValueError(f'question {number} needs 2 to {len(LETTERS)} non-empty options')
+        answer = question.get('correct_answer')
+        answer = answer.lower() if isinstance(answer, str) else None
+        if answer is None or len(answer) != 1 or answer not in LETTERS[:len(options)]:
+            raise ValueError(f'question {number} needs a correct_answer among {LETTERS[:len(options)]!r}')
+        serialized.append([text, options])
+        key.append(answer)
+    return json.dumps(serialized, ensure_ascii=False, separators=(',', ':')), ''.join(key)
+
+
+def load_questions(serialized):
+    return [{'question': text, 'options': options} for text, options in json.loads(serialized)]
+
+
+def answer_sheet(answers, length):
+    """The sheet string for a list of ``length`` letters (None or '' for a blank), or None if invalid."""
+    if not isinstance(answers, list) or len(answers) != length:
+        return None
+    letters = []
+    for answer in answers:
+        if answer is None or answer == '':
+            letters.append(BLANK)
+        elif isinstance(answer, str) and len(answer) == 1 and answer.lower() in LETTERS:
+            letters.append(answer.lower())
+        else:
+            return None
+    return ''.join(letters)
+
+
+class AnswerKey:
+    """An answer key packed for grading whole sheets."""
+
+    def __init__(self, letters):
+        self.letters = letters
+        self.length = len(letters)
+        self._key = int.from_bytes(letters.encode('ascii'), 'little')
+        self._low = int.from_bytes(b'\x7f' * self.length, 'little')
+        self._high = int.from_bytes(b'\x80' * self.length, 'little')
+
+    def grade(self, sheet):
+        """Grade a sheet from :func:`answer_sheet` of the same length."""
+        diff = int.from_bytes(sheet.encode('ascii'), 'little') ^ self._key
+        # High bit of each byte: set where any bit of diff's byte is, without
+        # carries between bytes; what stays clear marks a correct answer
+        matched = ~((diff & self._low) + self._low | diff) & self._high
+        flags = (matched >> 7).to_bytes(self.length, 'little')
+        results = int(flags.translate(_DIGITS)[::-1], 2)
+        return Grade(results, results.bit_count())
+
+
+@functools.lru_cache(maxsize=4096)
+def answer_key(letters):
+    """The compiled key for ``letters``; quizzes never change, so neither does their key."""
+    return AnswerKey(letters)
+
+
+def pack_results(results, length):
+    return results.to_bytes((length + 7) // 8, 'little')
+
+
+def unpack_results(blob):
+    return int.from_bytes(blob or b'', 'little')
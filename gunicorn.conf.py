@@ -0,0 +1,35 @@
+"""Gunicorn settings for serving ``wsgi:app`` on every core.
+
+The application is imported once in the master (``preload_app``) and the
+workers are forked from it, so each starts with the app already loaded.
+Run ``flask --app app migrate`` before the first start and after upgrades.
+"""
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1))
+# Each open /api/events stream holds one idle thread of its worker (about
+# 45 KB); streams get all but an eighth of the threads (at least 16), which
+# always stay free for ordinary requests
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 256))
+os.environ.setdefault('EVENT_MAX_STREAMS', str(max(threads - max(threads // 8, 16), 1)))
+preload_app = True
+timeout = 30
+keepalive = 5
+
+# One password hashing process per worker unless set, instead of two per
+# worker competing for the same cores
+os.environ.setdefault('PASSWORD_WORKERS', '1')
+# The app turns on its live refresh fallback when it runs in several workers
+os.environ.setdefault('WEB_CONCURRENCY', str(workers))
+
+
+def post_fork(server, worker):
+    import app
+    app.reset_after_fork()
+
+
+def worker_exit(server, worker):
+    import app
+    app.password_hasher.shutdown()
@@ -0,0 +1,156 @@
+"""Streaming parser and validator for bulk activity imports.
+
+CSV and JSONL files are read one record at a time, so a file of any size
+is held in memory only one chunk of valid rows at a time. Each record is
+checked against the same columns ``create_quiz``, ``create_poll`` and
+``create_challenge`` fill; invalid records become per-line errors instead
+of failing the import.
+"""
+import codecs
+import csv
+import json
+from datetime import datetime
+
+FORMATS = ('csv', 'jsonl')
+KINDS = ('quiz', 'poll', 'challenge')
+CHALLENGE_TYPES = ('quick', 'daily', 'weekly')
+DEFAULT_POINTS = {'quiz': 10, 'poll': 5, 'challenge': 20}
+MAX_TEXT = 200
+
+
+class InvalidRecord(ValueError):
+    pass
+
+
+def detect_format(filename=None, content_type=None):
+    """Guess ``csv`` or ``jsonl`` from a file name or content type, or return None."""
+    name = (filename or '').lower()
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if name.endswith('.csv') or content_type in ('text/csv', 'application/csv'):
+        return 'csv'
+    if name.endswith(('.jsonl', '.ndjson')) or content_type in ('application/x-ndjson', 'application/jsonl'):
+        return 'jsonl'
+    return None
+
+
+def _lines(stream):
+    # Accepts binary (uploads, request bodies, files opened 'rb') or text streams
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    for line in stream:
+        yield decoder.decode(line) if isinstance(line, bytes) else line
+
+
+def read_records(stream, fmt):
+    """Yield ``(line, record, error)`` for each record of a CSV or JSONL stream."""
+    if fmt == 'csv':
+        reader = csv.DictReader(_lines(stream))
+        for record in reader:
+            if None in record:
+                yield reader.line_num, None, 'Too many columns'
+            else:
+                yield reader.line_num, record, None
+        return
+
+    for number, line in enumerate(_lines(stream), start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as exc:
+            yield number, None, f'Invalid JSON: {exc}'
+            continue
+        if not isinstance(record, dict):
+            yield number, None, 'Each line must be a JSON object'
+            continue
+        yield number, record, None
+
+
+def _text(record, field, required=False, limit=MAX_TEXT):
+    value = record.get(field)
+    if value is not None and not isinstance(value, str):
+        value = str(value)
+    value = (value or '').strip()
+    if not value:
+        if required:
+            raise InvalidRecord(f'{field} is required')
+        return None
+    if limit and len(value) > limit:
+        raise InvalidRecord(f'{field} must be at most {limit} characters')
+    return value
+
+
+def _points(record, kind):
+    value = record.get('points')
+    if value is None or value == '':
+        return DEFAULT_POINTS[kind]
+    try:
+        points = int(value)
+    except (TypeError, ValueError):
+        raise InvalidRecord('points must be a whole number')
+    if points < 0:
+        raise InvalidRecord('points must not be negative')
+    return points
+
+
+def validate(record, kind):
+    """Column values for one ``kind`` record, or ``InvalidRecord`` with the reason."""
+    if kind == 'quiz':
+        values = {
+            'title': _text(record, 'title', required=True),
+            'question': _text(record, 'question', required=True, limit=None),
+        }
+        for option in 'abcd':
+            values[f'option_{option}'] = _text(record, f'option_{option}', required=True)
+        answer = (_text(record, 'correct_answer', required=True) or '').lower()
+        if answer not in ('a', 'b', 'c', 'd'):
+            raise InvalidRecord('correct_answer must be one of a, b, c, d')
+        values['correct_answer'] = answer
+    elif kind == 'poll':
+        values = {
+            'question': _text(record, 'question', required=True, limit=None),
+            'option_1': _text(record, 'option_1', required=True),
+            'option_2': _text(record, 'option_2', required=True),
+            'option_3': _text(record, 'option_3'),
+            'option_4': _text(record, 'option_4'),
+        }
+        if values['option_4'] and not values['option_3']:
+            raise InvalidRecord('option_4 needs option_3')
+    else:
+        values = {
+            'title': _text(record, 'title', required=True),
+            'description': _text(record, 'description', required=True, limit=None),
+            'challenge_type': (_text(record, 'challenge_type') or 'quick').lower(),
+            'due_date': None,
+        }
+        if values['challenge_type'] not in CHALLENGE_TYPES:
+            raise InvalidRecord(f"challenge_type must be one of {', '.join(CHALLENGE_TYPES)}")
+        due_date = _text(record, 'due_date')
+        if due_date:
+            try:
+                values['due_date'] = datetime.fromisoformat(due_date)
+            except ValueError:
+                raise InvalidRecord('due_date must be an ISO 8601 date')
+    values['points'] = _points(record, kind)
+    return values
+
+
+def parse_activities(stream, fmt, default_kind=None):
+    """Yield ``(line, kind, values, error)`` for every record of ``stream``.
+
+    A record's kind comes from its ``type`` field, or ``default_kind`` when
+    it has none. Exactly one of ``values`` and ``error`` is set.
+    """
+    for line, record, error in read_records(stream, fmt):
+        if error is not None:
+            yield line, None, None, error
+            continue
+        kind = str(record.get('type') or default_kind or '').strip().lower()
+        if kind not in KINDS:
+            yield line, None, None, f"type must be one of {', '.join(KINDS)}"
+            continue
+        try:
+            values = validate(record, kind)
+        except InvalidRecord as exc:
+            yield line, kind, None, str(exc)
+            continue
+        yield line, kind, values, None
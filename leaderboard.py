@@ -0,0 +1,169 @@
+"""In-memory ranked leaderboard index.
+
+Students are kept in a list sorted by (points desc, badges desc, user id)
+so reading a page or a single rank is a bisect instead of sorting the
+whole user table on every request.
+"""
+import threading
+import time
+from bisect import bisect_left, insort
+
+
+class RankIndex:
+    """Sorted rank structure for one leaderboard (global or per class)."""
+
+    def __init__(self):
+        self._keys = []
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, user_id):
+        return user_id in self._entries
+
+    @staticmethod
+    def _key(user_id, points, badges):
+        return (-(points or 0), -(badges or 0), user_id)
+
+    def put(self, user_id, username, points, badges):
+        old = self._entries.get(user_id)
+        key = self._key(user_id, points, badges)
+        if old is not None:
+            if old[0] == key:
+                self._entries[user_id] = (key, username)
+                return
+            del self._keys[bisect_left(self._keys, old[0])]
+        insort(self._keys, key)
+        self._entries[user_id] = (key, username)
+
+    def remove(self, user_id):
+        old = self._entries.pop(user_id, None)
+        if old is not None:
+            del self._keys[bisect_left(self._keys, old[0])]
+
+    def rank(self, user_id):
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        return bisect_left(self._keys, entry[0]) + 1
+
+    def _row(self, position):
+        key = self._keys[position]
+        user_id = key[2]
+        return {
+            'rank': position + 1,
+            'user_id': user_id,
+            'username': self._entries[user_id][1],
+            'points': -key[0],
+            'badges': -key[1],
+        }
+
+    def page(self, offset, limit):
+        end = min(len(self._keys), offset + limit)
+        return [self._row(i) for i in range(offset, end)]
+
+    def around(self, user_id, radius):
+        rank = self.rank(user_id)
+        if rank is None:
+            return None, []
+        start = max(0, rank - 1 - radius)
+        return rank, self.page(start, rank + radius - start)
+
+    def get(self, user_id):
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        key, username = entry
+        return username, -key[0], -key[1]
+
+
+class Leaderboard:
+    """Global board plus lazily built per-class boards.
+
+    ``load_students`` returns ``(user_id, username, points, badges)`` rows
+    for every student and ``load_members`` returns the user ids enrolled in
+    a class. Both are only called on (re)load; afterwards the write paths
+    keep the boards current through ``update`` and ``add_member``. The
+    boards are rebuilt every ``refresh_seconds`` so that processes which
+    did not see a write converge.
+    """
+
+    def __init__(self, load_students, load_members, refresh_seconds=300):
+        self._load_students = load_students
+        self._load_members = load_members
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.RLock()
+        self._global = None
+        self._classes = {}
+        self._memberships = {}
+        self._loaded_at = 0.0
+
+    def _ensure_loaded(self):
+        if self._global is not None and time.monotonic() - self._loaded_at < self.refresh_seconds:
+            return
+        board = RankIndex()
+        for user_id, username, points, badges in self._load_students():
+            board.put(user_id, username, points, badges)
+        self._global = board
+        self._classes = {}
+        self._memberships = {}
+        self._loaded_at = time.monotonic()
+
+    def _class_board(self, class_id):
+        board = self._classes.get(class_id)
+        if board is None:
+            board = RankIndex()
+            for user_id in self._load_members(class_id):
+                entry = self._global.get(user_id)
+                if entry is not None:
+                    board.put(user_id, *entry)
+                    self._memberships.setdefault(user_id, set()).add(class_id)
+            self._classes[class_id] = board
+        return board
+
+    def _board(self, class_id):
+        self._ensure_loaded()
+        if class_id is None:
+            return self._global
+        return self._class_board(class_id)
+
+    def page(self, offset=0, limit=20, class_id=None):
+        with self._lock:
+            board = self._board(class_id)
+            return board.page(offset, limit), len(board)
+
+    def around(self, user_id, radius=2, class_id=None):
+        with self._lock:
+            board = self._board(class_id)
+            rank, rows = board.around(user_id, radius)
+            return rank, rows, len(board)
+
+    def update(self, user_id, username, points, badges=None, new_badges=0):
+        with self._lock:
+            if self._global is None:
+                return
+            if badges is None:
+                current = self._global.get(user_id)
+                badges = (current[2] if current else 0) + new_badges
+            self._global.put(user_id, username, points, badges)
+            for class_id in self._memberships.get(user_id, ()):
+                board = self._classes.get(class_id)
+                if board is not None:
+                    board.put(user_id, username, points, badges)
+
+    def add_member(self, class_id, user_id):
+        with self._lock:
+            if self._global is None:
+                return
+            board = self._classes.get(class_id)
+            entry = self._global.get(user_id)
+            if board is not None and entry is not None:
+                board.put(user_id, *entry)
+                self._memberships.setdefault(user_id, set()).add(class_id)
+
+    def invalidate(self):
+        with self._lock:
+            self._global = None
+            self._classes = {}
+            self._memberships = {}
@@ -5,8 +5,8 @@ function showLeaderboard() {
         .then(response => response.json())
         .then(data => {
             let leaderboardHTML = '<h2>🏆 Leaderboard</h2><div class="leaderboard-list">';
-            data.forEach((user, index) => {
-                const medal = index === 0 ? '🥇' : index === 1 ? '🥈' : index === 2 ? '🥉' : `${index + 1}.`;
+            data.forEach(user => {
+                const medal = user.rank === 1 ? '🥇' : user.rank === 2 ? '🥈' : user.rank === 3 ? '🥉' : `${user.rank}.`;
                 leaderboardHTML += `
                     <div class="leaderboard-item" style="display: flex; justify-content: space-between; padding: 1rem; background: var(--light-color); margin: 0.5rem 0; border-radius: 5px;">
                         <div>
@@ -122,27 +122,210 @@ function showBadges() {
         });
 }
 
-// Update user points on page load and periodically
-function updateUserPointsNav() {
+// Discussion board: one page of threads at a time, new posts merged in place
+let discussionState = null;
+
+function renderDiscussionPost(post) {
+    const element = document.createElement('div');
+    element.className = 'discussion-post';
+    element.id = `discussion-post-${post.id}`;
+    if (post.parent_id) {
+        element.style.marginTop = '0.5rem';
+    }
+    element.innerHTML = `
+        <div class="discussion-post-header">
+            <span><strong>${post.username}</strong></span>
+            <span>${new Date(post.created_at).toLocaleString()}</span>
+        </div>
+        <p>${post.content}</p>
+        <div class="discussion-replies"></div>
+    `;
+    const replies = element.querySelector('.discussion-replies');
+    post.replies.forEach(reply => replies.appendChild(renderDiscussionPost(reply)));
+    return element;
+}
+
+function loadDiscussions(classId) {
+    discussionState = {classId: classId, nextCursor: null, sinceCursor: ''};
+    document.getElementById('discussionsContainer').innerHTML = `
+        <h3>Discussion Board</h3>
+        <button class="btn btn-primary btn-small" onclick="showCreateDiscussionModal(${classId})">New Post</button>
+        <div id="discussionPosts" style="margin-top: 1rem;"></div>
+        <button class="btn btn-secondary btn-small" id="loadMoreDiscussions" style="display: none;" onclick="loadMoreDiscussions()">Load More</button>
+    `;
+    fetchDiscussionPage();
+}
+
+function loadMoreDiscussions() {
+    fetchDiscussionPage();
+}
+
+function fetchDiscussionPage() {
+    const state = discussionState;
+    const cursor = state.nextCursor ? `?cursor=${encodeURIComponent(state.nextCursor)}` : '';
+    fetch(`/api/discussion/${state.classId}${cursor}`)
+        .then(async response => {
+            const data = await response.json();
+            const postsDiv = document.getElementById('discussionPosts');
+            if (!state.nextCursor) {
+                state.sinceCursor = response.headers.get('X-Since-Cursor') || '';
+                if (data.length === 0) {
+                    postsDiv.innerHTML = '<p id="noDiscussions">No discussions yet. Start one!</p>';
+                }
+            }
+            data.forEach(post => postsDiv.appendChild(renderDiscussionPost(post)));
+            state.nextCursor = response.headers.get('X-Next-Cursor');
+            document.getElementById('loadMoreDiscussions').style.display = state.nextCursor ? 'inline-block' : 'none';
+        })
+        .catch(error => {
+            console.error('Error:', error);
+            alert('Failed to load discussions');
+        });
+}
+
+function refreshDiscussions(classId) {
+    const state = discussionState;
+    if (!state || state.classId !== classId || !document.getElementById('discussionPosts')) {
+        loadDiscussions(classId);
+        return;
+    }
+    fetch(`/api/discussion/${classId}?since=${encodeURIComponent(state.sinceCursor)}`)
+        .then(async response => {
+            const data = await response.json();
+            state.sinceCursor = response.headers.get('X-Since-Cursor') || state.sinceCursor;
+            const postsDiv = document.getElementById('discussionPosts');
+            const placeholder = document.getElementById('noDiscussions');
+            if (placeholder && data.length > 0) {
+                placeholder.remove();
+            }
+            data.forEach(post => {
+                if (document.getElementById(`discussion-post-${post.id}`)) {
+                    return;
+                }
+                if (!post.parent_id) {
+                    postsDiv.prepend(renderDiscussionPost(post));
+                    return;
+                }
+                // Replies to threads that are not on screen arrive with their page
+                const parent = document.getElementById(`discussion-post-${post.parent_id}`);
+                if (parent) {
+                    parent.querySelector('.discussion-replies').appendChild(renderDiscussionPost(post));
+                }
+            });
+        })
+        .catch(() => loadDiscussions(classId));
+}
+
+// One request for everything the dashboard shows; pages listen for elearning:dashboard
+function refreshDashboard(fields) {
     if (document.getElementById('user-points')) {
-        fetch('/api/user/points')
+        fetch(`/api/dashboard?fields=${fields}`)
             .then(response => response.json())
             .then(data => {
-                if (data.points !== undefined) {
-                    document.getElementById('user-points').textContent = data.points;
+                if (data.profile) {
+                    document.getElementById('user-points').textContent = data.profile.points;
+                    emitLiveEvent('dashboard', data);
                 }
             })
             .catch(() => {});
     }
 }
 
+function updateUserPointsNav() {
+    refreshDashboard('profile');
+}
+
+// Pages rendered with the user's points need no request for them
+function loadUserPointsNav() {
+    const points = document.getElementById('user-points');
+    if (points && !points.hasAttribute('data-rendered')) {
+        updateUserPointsNav();
+    }
+}
+
+// Live updates: the event stream replaces polling while it is connected
+let pointsPollTimer = null;
+// Events published in other server workers never reach this stream, so the
+// server may ask for the dashboard to be re-fetched while it is connected
+let liveRefreshTimer = null;
+
+function startPointsPolling() {
+    stopLiveRefresh();
+    if (!pointsPollTimer) {
+        pointsPollTimer = setInterval(updateUserPointsNav, 30000); // Update every 30 seconds
+    }
+}
+
+function stopPointsPolling() {
+    clearInterval(pointsPollTimer);
+    pointsPollTimer = null;
+}
+
+function startLiveRefresh(seconds) {
+    stopLiveRefresh();
+    if (seconds > 0) {
+        liveRefreshTimer = setInterval(() => refreshDashboard('profile,badges,classes'), seconds * 1000);
+    }
+}
+
+function stopLiveRefresh() {
+    clearInterval(liveRefreshTimer);
+    liveRefreshTimer = null;
+}
+
+function emitLiveEvent(name, detail) {
+    document.dispatchEvent(new CustomEvent(`elearning:${name}`, {detail: detail}));
+}
+
+function connectLiveUpdates() {
+    if (!document.getElementById('user-points')) {
+        return;
+    }
+    if (!window.EventSource) {
+        startPointsPolling();
+        return;
+    }
+    const source = new EventSource('/api/events');
+    source.onopen = stopPointsPolling;
+    // EventSource reconnects on its own; poll until it does
+    source.onerror = () => {
+        startPointsPolling();
+        // Turned away while the server holds its most streams: keep polling, try again later
+        if (source.readyState === EventSource.CLOSED) {
+            setTimeout(connectLiveUpdates, 60000);
+        }
+    };
+    source.addEventListener('live', e => startLiveRefresh(JSON.parse(e.data).refresh_seconds));
+    source.addEventListener('points', e => {
+        const data = JSON.parse(e.data);
+        document.getElementById('user-points').textContent = data.points;
+        emitLiveEvent('points', data);
+    });
+    source.addEventListener('badge_awarded', e => {
+        const badgeCount = document.getElementById('badge-count');
+        if (badgeCount) {
+            badgeCount.textContent = parseInt(badgeCount.textContent || '0') + 1;
+        }
+        emitLiveEvent('badge_awarded', JSON.parse(e.data));
+    });
+    source.addEventListener('new_activity', e => emitLiveEvent('new_activity', JSON.parse(e.data)));
+    source.addEventListener('new_post', e => {
+        const post = JSON.parse(e.data);
+        if (discussionState && discussionState.classId === post.class_id) {
+            refreshDiscussions(post.class_id);
+        }
+    });
+    source.addEventListener('resync', () => refreshDashboard('profile,badges,classes'));
+}
+
 // Update on page load
 if (document.readyState === 'loading') {
-    document.addEventListener('DOMContentLoaded', updateUserPointsNav);
+    document.addEventListener('DOMContentLoaded', () => {
+        loadUserPointsNav();
+        connectLiveUpdates();
+    });
 } else {
-    updateUserPointsNav();
+    loadUserPointsNav();
+    connectLiveUpdates();
 }
 
-// Update user points periodically
-setInterval(updateUserPointsNav, 30000); // Update every 30 seconds
-
@@ -0,0 +1,222 @@
+"""Process-local metrics with a Prometheus text exposition.
+
+Counters and histograms are plain dicts keyed by label values behind one
+lock, so recording is a few dict operations per request. Values that
+other components already count (cache hits, queue depth) are read through
+callbacks at scrape time instead of being recorded twice.
+"""
+import bisect
+import random
+import threading
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {} if self.labelnames else {(): 0}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} counter'
+        for key, value in values:
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def collect(self):
+        with self._lock:
+            values = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames + ('le',), key + (bound if bound == '+Inf' else _format_value(float(bound)),))
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _format_labels(self.labelnames, key)
+            yield f'{self.name}_sum{labels} {_format_value(float(total))}'
+            yield f'{self.name}_count{labels} {count}'
+
+
+class Callback:
+    """Metric whose samples are read from ``func`` at scrape time.
+
+    ``func`` returns a number, or a dict of label value tuples to numbers.
+    """
+
+    def __init__(self, name, help, kind, func, labelnames=()):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.func = func
+        self.labelnames = tuple(labelnames)
+
+    def collect(self):
+        values = self.func()
+        if not isinstance(values, dict):
+            values = {(): values}
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} {self.kind}'
+        for key, value in sorted(values.items()):
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name, help, kind, func, labelnames=()):
+        return self._register(Callback(name, help, kind, func, labelnames))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+class Timer:
+    """Context manager that observes its duration on a histogram."""
+
+    def __init__(self, histogram, **labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+class RequestMetrics:
+    """Per-route request latency, SQL statement count and DB time.
+
+    Every request is timed; the statements of a request are only kept when
+    it is picked for the slow-request log (``slow_sample_rate``), and then
+    logged if it took longer than ``slow_seconds``.
+    """
+
+    def __init__(self, registry, logger, slow_seconds=1.0, slow_sample_rate=0.0):
+        self.logger = logger
+        self.slow_seconds = slow_seconds
+        self.slow_sample_rate = slow_sample_rate
+        labels = ('route', 'method', 'status')
+        self.latency = registry.histogram('elearning_request_duration_seconds', 'Request latency', labels)
+        self.queries = registry.histogram('elearning_request_queries', 'SQL statements per request', labels, QUERY_BUCKETS)
+        self.db_time = registry.counter('elearning_request_db_seconds_total', 'Time spent in SQL statements', labels)
+        self.background_db_time = registry.counter(
+            'elearning_background_db_seconds_total', 'Time spent in SQL statements outside requests')
+
+    def init_app(self, app, engines):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', self._before_execute)
+            event.listen(engine, 'after_cursor_execute', self._after_execute)
+
+    def _before_request(self):
+        g.metrics = {'started': time.perf_counter(), 'queries': 0, 'db_seconds': 0.0, 'recorded': False,
+                     'statements': [] if self.slow_sample_rate and random.random() < self.slow_sample_rate else None}
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        context.metrics_started = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context.metrics_started
+        state = g.get('metrics') if has_request_context() else None
+        if state is None:
+            self.background_db_time.inc(elapsed)
+            return
+        state['queries'] += 1
+        state['db_seconds'] += elapsed
+        if state['statements'] is not None:
+            state['statements'].append((elapsed, statement))
+
+    def _record(self, status):
+        state = g.get('metrics')
+        if state is None or state['recorded']:
+            return
+        state['recorded'] = True
+        elapsed = time.perf_counter() - state['started']
+        labels = {'route': request.url_rule.rule if request.url_rule else 'unmatched',
+                  'method': request.method, 'status': status}
+        self.latency.observe(elapsed, **labels)
+        self.queries.observe(state['queries'], **labels)
+        self.db_time.inc(state['db_seconds'], **labels)
+        if state['statements'] is not None and elapsed >= self.slow_seconds:
+            statements = '\n'.join(f'  {seconds * 1000:8.2f} ms  {statement}' for seconds, statement in state['statements'])
+            self.logger.warning('Slow request %s %s -> %s in %.0f ms, %d statements (%.0f ms in SQL):\n%s',
+                                request.method, request.full_path.rstrip('?'), status, elapsed * 1000,
+                                state['queries'], state['db_seconds'] * 1000, statements)
+
+    def _after_request(self, response):
+        self._record(response.status_code)
+        return response
+
+    def _teardown_request(self, exc):
+        if exc is not None:
+            self._record(500)
@@ -0,0 +1,210 @@
+"""Versioned schema migrations, applied in place.
+
+``db.create_all()`` only creates missing tables: it never adds an index,
+a constraint or a column to a table that already exists. Each migration
+here brings the schema from the previous version to its own and is
+recorded in ``schema_version``; ``upgrade`` applies the ones a database
+has not seen yet, each in its own transaction.
+
+A new database runs every migration too, after the baseline has created
+its tables from the current models. Migrations must therefore be safe to
+apply to tables that already have their changes (``IF NOT EXISTS``, or a
+check first), which also makes one that failed halfway safe to rerun.
+"""
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+import search
+from scheduler import PERIODS
+
+Migration = namedtuple('Migration', ['version', 'description', 'apply'])
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    def decorator(apply):
+        MIGRATIONS.append(Migration(version, description, apply))
+        return apply
+    return decorator
+
+
+def current_version(connection):
+    if not inspect(connection).has_table('schema_version'):
+        return None
+    return connection.execute(text('SELECT max(version) FROM schema_version')).scalar()
+
+
+def create_index(connection, name, table, columns, unique=False):
+    connection.execute(text(
+        f'CREATE {"UNIQUE " if unique else ""}INDEX IF NOT EXISTS {name} ON "{table}" ({", ".join(columns)})'))
+
+
+def delete_duplicates(connection, table, columns):
+    """Keep the first row (lowest id) of every group of equal ``columns``; returns the rows deleted."""
+    return connection.execute(text(
+        f'DELETE FROM "{table}" WHERE id NOT IN (SELECT min(id) FROM "{table}" GROUP BY {", ".join(columns)})'
+    )).rowcount
+
+
+@migration(1, 'Create the tables of the models')
+def create_tables(connection, metadata):
+    metadata.create_all(connection)
+
+
+# The search sources as of version 2: quizzes had a single question, and
+# the question list column they index now does not exist yet
+SEARCH_SOURCES_V2 = dict(search.SOURCES, quiz=(
+    'quiz', '{row}.title', "{row}.question || ' ' || {row}.option_a || ' ' || {row}.option_b || ' ' || "
+                           "{row}.option_c || ' ' || {row}.option_d"))
+
+
+@migration(2, 'Full-text search index with sync triggers')
+def create_search_index(connection, metadata):
+    if search.supported(connection.engine):
+        search.install(connection, SEARCH_SOURCES_V2)
+        search.rebuild(connection, SEARCH_SOURCES_V2)
+
+
+# (name, table, columns) of the lookups every request makes
+LOOKUP_INDEXES = (
+    ('ix_user_role_points', 'user', ('role', 'points')),
+    ('ix_online_class_teacher', 'online_class', ('teacher_id',)),
+    ('ix_class_enrollment_class_user', 'class_enrollment', ('class_id', 'user_id')),
+    ('ix_quiz_class', 'quiz', ('class_id',)),
+    ('ix_poll_class', 'poll', ('class_id',)),
+    ('ix_challenge_class', 'challenge', ('class_id',)),
+    ('ix_quiz_response_quiz', 'quiz_response', ('quiz_id',)),
+    ('ix_quiz_response_user_quiz', 'quiz_response', ('user_id', 'quiz_id', 'is_correct')),
+    ('ix_poll_response_user_poll', 'poll_response', ('user_id', 'poll_id')),
+    ('ix_challenge_response_challenge', 'challenge_response', ('challenge_id',)),
+    ('ix_challenge_response_user_challenge', 'challenge_response', ('user_id', 'challenge_id', 'is_completed')),
+    ('ix_discussion_post_class_created', 'discussion_post', ('class_id', 'created_at')),
+    ('ix_discussion_post_parent', 'discussion_post', ('parent_id',)),
+    ('ix_points_ledger_created', 'points_ledger', ('created_at', 'user_id', 'delta')),
+)
+# One enrollment per student and class, one vote per student and poll, each badge once
+UNIQUE_INDEXES = (
+    ('uq_class_enrollment_user_class', 'class_enrollment', ('user_id', 'class_id')),
+    ('uq_poll_response_poll_user', 'poll_response', ('poll_id', 'user_id')),
+    ('uq_user_badge_user_badge', 'user_badge', ('user_id', 'badge_id')),
+)
+
+
+@migration(3, 'Lookup indexes, and unique enrollments, poll votes and badges')
+def create_lookup_indexes(connection, metadata):
+    for name, table, columns in LOOKUP_INDEXES:
+        create_index(connection, name, table, columns)
+    # Duplicate enrollments keep the first row, with the attendance of all of them
+    connection.execute(text(
+        'UPDATE class_enrollment SET '
+        'attendance_count = (SELECT sum(coalesce(other.attendance_count, 0)) FROM class_enrollment AS other '
+        'WHERE other.class_id = class_enrollment.class_id AND other.user_id = class_enrollment.user_id), '
+        'last_attended = (SELECT max(other.last_attended) FROM class_enrollment AS other '
+        'WHERE other.class_id = class_enrollment.class_id AND other.user_id = class_enrollment.user_id) '
+        'WHERE id IN (SELECT min(id) FROM class_enrollment GROUP BY user_id, class_id HAVING count(*) > 1)'))
+    for name, table, columns in UNIQUE_INDEXES:
+        delete_duplicates(connection, table, columns)
+        create_index(connection, name, table, columns, unique=True)
+
+
+@migration(4, 'Class sessions, and enrollment ordinals for their attendance bitmaps')
+def create_class_sessions(connection, metadata):
+    metadata.tables['class_session'].create(connection, checkfirst=True)
+    create_index(connection, 'ix_class_session_class_started', 'class_session', ('class_id', 'started_at'))
+    if 'ordinal' not in {column['name'] for column in inspect(connection).get_columns('class_enrollment')}:
+        connection.execute(text('ALTER TABLE class_enrollment ADD COLUMN ordinal INTEGER NOT NULL DEFAULT 0'))
+        # Existing students are numbered in the order they enrolled
+        connection.execute(text(
+            'UPDATE class_enrollment SET ordinal = numbered.ordinal - 1 FROM ('
+            'SELECT id, row_number() OVER (PARTITION BY class_id ORDER BY id) AS ordinal FROM class_enrollment'
+            ') AS numbered WHERE numbered.id = class_enrollment.id'))
+    create_index(connection, 'uq_class_enrollment_class_ordinal', 'class_enrollment', ('class_id', 'ordinal'),
+                 unique=True)
+
+
+@migration(5, 'Scheduled jobs, closing and recurring challenges, one completion per challenge')
+def create_scheduled_jobs(connection, metadata):
+    metadata.tables['scheduled_job'].create(connection, checkfirst=True)
+    columns = {column['name'] for column in inspect(connection).get_columns('challenge')}
+    for name in ('closed_at', 'series_id'):
+        if name not in columns:
+            connection.execute(text(f'ALTER TABLE challenge ADD COLUMN {name} '
+                                    f'{"DATETIME" if name == "closed_at" else "INTEGER"}'))
+    create_index(connection, 'ix_challenge_class_due', 'challenge', ('class_id', 'due_date'))
+    # Completions beyond the first keep the points they earned
+    delete_duplicates(connection, 'challenge_response', ('challenge_id', 'user_id'))
+    create_index(connection, 'uq_challenge_response_challenge_user', 'challenge_response', ('challenge_id', 'user_id'),
+                 unique=True)
+
+    # Recurring challenges without a due date ran for one period from creation;
+    # the ones already past it close on the next scheduler run and roll over
+    undated = connection.execute(text(
+        "SELECT id, challenge_type, created_at FROM challenge WHERE due_date IS NULL AND challenge_type IN ('daily', 'weekly')"
+    )).all()
+    if undated:
+        now = datetime.utcnow()
+        connection.execute(text('UPDATE challenge SET due_date = :due_date WHERE id = :id'), [
+            {'id': row.id, 'due_date': _stored((_timestamp(row.created_at) or now) + PERIODS[row.challenge_type])}
+            for row in undated])
+    connection.execute(text(
+        "INSERT INTO scheduled_job (kind, target_id, run_at) SELECT 'close_challenge', id, due_date FROM challenge "
+        "WHERE due_date IS NOT NULL AND closed_at IS NULL AND id NOT IN "
+        "(SELECT target_id FROM scheduled_job WHERE kind = 'close_challenge')"))
+
+
+@migration(6, 'Multi-question quizzes, their per-question stats and search')
+def create_question_lists(connection, metadata):
+    for table, columns in (('quiz', (('questions', 'TEXT'), ('answer_key', 'TEXT'),
+                                     ('question_count', 'INTEGER NOT NULL DEFAULT 1'))),
+                           ('quiz_response', (('answers', 'TEXT'), ('results', 'BLOB')))):
+        existing = {column['name'] for column in inspect(connection).get_columns(table)}
+        for name, definition in columns:
+            if name not in existing:
+                connection.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} {definition}'))
+    metadata.tables['quiz_question_stats'].create(connection, checkfirst=True)
+    if search.supported(connection.engine):
+        # The quiz triggers now also index the question lists
+        search.drop_triggers(connection, 'quiz')
+        search.install(connection)
+        search.rebuild(connection)
+
+
+@migration(7, 'One graded answer sheet per student and multi-question quiz')
+def create_unique_sheets(connection, metadata):
+    # Later sheets keep the points they earned
+    connection.execute(text(
+        'DELETE FROM quiz_response WHERE answers IS NOT NULL AND id NOT IN '
+        '(SELECT min(id) FROM quiz_response WHERE answers IS NOT NULL GROUP BY quiz_id, user_id)'))
+    connection.execute(text('CREATE UNIQUE INDEX IF NOT EXISTS uq_quiz_response_quiz_user_sheet '
+                            'ON quiz_response (quiz_id, user_id) WHERE answers IS NOT NULL'))
+
+
+def _timestamp(value):
+    # SQLite hands DATETIME columns back as text to plain SQL
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _stored(value):
+    # The text SQLAlchemy stores, so the column keeps comparing as times
+    return value.isoformat(' ', 'microseconds')
+
+
+SCHEMA_VERSION = MIGRATIONS[-1].version
+
+
+def upgrade(engine, metadata):
+    """Apply every migration newer than the database's version and return them."""
+    applied = []
+    for pending in MIGRATIONS:
+        with engine.begin() as connection:
+            version = current_version(connection)
+            if version is not None and version >= pending.version:
+                continue
+            pending.apply(connection, metadata)
+            connection.execute(text('INSERT INTO schema_version (version, applied_at) VALUES (:version, :applied_at)'),
+                               {'version': pending.version, 'applied_at': datetime.utcnow()})
+        applied.append(pending)
+    return applied
@@ -0,0 +1,100 @@
+"""Password hashing off the request threads.
+
+Hashes are deliberately slow, so hashing and checking run on a small
+process pool: a burst of logins uses at most ``workers`` cores and the
+request threads only wait on a future, leaving the rest of the API
+responsive. At most ``max_pending`` operations are queued or running;
+beyond that callers get :class:`HasherBusy` and should answer 503.
+"""
+import itertools
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HasherBusy(Exception):
+    """Raised when ``max_pending`` hash operations are already waiting."""
+
+
+class PasswordHasher:
+    """Bounded pool for ``generate_password_hash``/``check_password_hash``.
+
+    ``method`` is the Werkzeug method string new hashes use (for example
+    ``scrypt:32768:8:1``); stored hashes with other parameters report
+    :meth:`needs_rehash`. With ``workers`` set to 0 operations run in the
+    calling thread, still limited to ``max_pending`` at a time. The pool is
+    started on first use, so each forked server worker gets its own.
+    Operations that take longer than ``timeout`` also raise ``HasherBusy``.
+    """
+
+    def __init__(self, method, workers=2, max_pending=32, timeout=10):
+        self.method = method
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_pid = None
+        self.rejected = 0
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HasherBusy()
+        with self._lock:
+            self._pending += 1
+        try:
+            if self.workers <= 0:
+                return func(*args)
+            return self._executor().submit(func, *args).result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise HasherBusy()
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool for the next caller
+            with self._lock:
+                self._pool = None
+            raise
+        finally:
+            with self._lock:
+                self._pending -= 1
+            self._slots.release()
+
+    def pending(self):
+        return self._pending
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def check(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        return password_hash.split('$', 1)[0] != self.method
+
+    def hash_many(self, passwords, workers=None):
+        """Hash ``passwords`` on every core, for offline bulk provisioning."""
+        passwords = list(passwords)
+        workers = workers or os.cpu_count() or 1
+        if workers == 1 or len(passwords) < 2:
+            return [generate_password_hash(password, self.method) for password in passwords]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunksize = max(1, len(passwords) // (workers * 4))
+            return list(pool.map(generate_password_hash, passwords, itertools.repeat(self.method), chunksize=chunksize))
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
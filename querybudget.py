@@ -0,0 +1,121 @@
+"""Per-request SQL budgets and N+1 detection.
+
+Every statement a request runs is counted and reduced to a fingerprint
+(literals and ``IN`` lists collapsed), so a lazy load inside a loop shows
+up as one shape repeated once per row. Views declare how many statements
+they may run with :func:`query_budget`; requests that exceed it, or that
+repeat a shape more than ``repeat_limit`` times, are reported.
+"""
+import re
+import threading
+from collections import Counter, deque, namedtuple
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+_SPACE = re.compile(r'\s+')
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+
+Violation = namedtuple('Violation', ['route', 'method', 'queries', 'budget', 'repeated'])
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised in ``raise`` mode when a request goes over its budget or repeats a statement."""
+
+    def __init__(self, violation):
+        super().__init__(describe(violation))
+        self.violation = violation
+
+
+def fingerprint(statement):
+    statement = _LITERALS.sub('?', _SPACE.sub(' ', statement.strip()))
+    return _IN_LISTS.sub('(?)', statement)
+
+
+def describe(violation):
+    problems = []
+    if violation.budget is not None and violation.queries > violation.budget:
+        problems.append(f'{violation.queries} statements, budget {violation.budget}')
+    for shape, count in violation.repeated:
+        problems.append(f'{count}x {shape[:160]}')
+    return f'{violation.method} {violation.route}: ' + '; '.join(problems)
+
+
+def query_budget(max_queries, chunked=False):
+    """Declare the most SQL statements a view may run per request.
+
+    ``chunked`` views run the same statements once per chunk of input, so
+    repeated shapes are expected and not reported; ``max_queries`` may then
+    be None.
+    """
+    def decorator(view):
+        view.query_budget = max_queries
+        view.query_chunked = chunked
+        return view
+    return decorator
+
+
+class QueryBudget:
+    """Counts and fingerprints the statements of each request.
+
+    ``mode`` is ``warn`` (log violations), ``raise`` (fail the request with
+    :class:`QueryBudgetExceeded`, for test runs) or ``record`` (only keep
+    them in ``violations``, which holds the latest ``keep``). The largest
+    statement count seen per route is kept in ``peaks``.
+    """
+
+    def __init__(self, mode='warn', repeat_limit=2, default_budget=None, logger=None, keep=1000):
+        self.mode = mode
+        self.repeat_limit = repeat_limit
+        self.default_budget = default_budget
+        self.logger = logger
+        self.violations = deque(maxlen=keep)
+        self.peaks = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app, engines):
+        self._app = app
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _before_request(self):
+        g.query_shapes = Counter()
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        if has_request_context():
+            shapes = g.get('query_shapes')
+            if shapes is not None:
+                shapes[fingerprint(statement)] += 1
+
+    def budget_for(self, endpoint):
+        view = self._app.view_functions.get(endpoint)
+        return getattr(view, 'query_budget', self.default_budget)
+
+    def is_chunked(self, endpoint):
+        return getattr(self._app.view_functions.get(endpoint), 'query_chunked', False)
+
+    def _after_request(self, response):
+        shapes = g.pop('query_shapes', None)
+        if shapes is None or request.url_rule is None:
+            return response
+        route = request.url_rule.rule
+        queries = sum(shapes.values())
+        budget = self.budget_for(request.endpoint)
+        repeated = [] if self.is_chunked(request.endpoint) else [
+            (shape, count) for shape, count in shapes.most_common() if count > self.repeat_limit]
+        with self._lock:
+            self.peaks[(request.method, route)] = max(queries, self.peaks.get((request.method, route), 0))
+        if not repeated and (budget is None or queries <= budget):
+            return response
+
+        violation = Violation(route, request.method, queries, budget, repeated)
+        with self._lock:
+            self.violations.append(violation)
+        if self.mode == 'raise':
+            raise QueryBudgetExceeded(violation)
+        if self.mode == 'warn' and self.logger is not None:
+            self.logger.warning('Query budget: %s', describe(violation))
+        return response
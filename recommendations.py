@@ -0,0 +1,88 @@
+"""Coalescing background refresh of per-user recommendation snapshots.
+
+Write paths mark keys dirty after they commit; a single worker thread waits
+``delay`` seconds so that a burst of marks for the same users is folded
+into one recompute, then hands the accumulated keys to ``refresh``. Only
+marks made in this process are seen, but the snapshots ``refresh`` writes
+are shared through the database.
+"""
+import threading
+import time
+
+
+class SnapshotRefresher:
+    """Dirty-key set drained by a worker thread in groups of ``max_batch``.
+
+    ``refresh`` receives a set of keys and recomputes whatever they stand
+    for; what a key means is up to the caller. With ``delay`` set to 0 no
+    thread is started and ``mark`` refreshes inline.
+    """
+
+    def __init__(self, refresh, delay=1.0, max_batch=500, on_error=None):
+        self._refresh = refresh
+        self.delay = delay
+        self.max_batch = max_batch
+        self._on_error = on_error
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.refreshed = 0
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='snapshot-refresher', daemon=True)
+                self._thread.start()
+
+    def mark(self, keys):
+        keys = set(keys)
+        if not keys:
+            return
+        if self.delay <= 0:
+            self._apply(keys)
+            return
+        with self._lock:
+            self._dirty |= keys
+        self._ensure_worker()
+        self._wakeup.set()
+
+    def pending(self):
+        with self._lock:
+            return len(self._dirty)
+
+    def drain(self):
+        """Refresh everything marked so far in the calling thread."""
+        while True:
+            keys = self._take()
+            if not keys:
+                return
+            self._apply(keys)
+
+    def _take(self):
+        with self._lock:
+            if len(self._dirty) <= self.max_batch:
+                keys, self._dirty = self._dirty, set()
+            else:
+                keys = set()
+                for _ in range(self.max_batch):
+                    keys.add(self._dirty.pop())
+            return keys
+
+    def _apply(self, keys):
+        try:
+            self._refresh(keys)
+        except Exception as exc:
+            if self._on_error is not None:
+                self._on_error(exc)
+            return
+        self.refreshed += len(keys)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            time.sleep(self.delay)
+            self.drain()
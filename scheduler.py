@@ -0,0 +1,127 @@
+"""Timer-driven jobs, persisted in the database and run in due order.
+
+Jobs are rows with a ``run_at`` time; the index on ``run_at`` is the
+durable priority queue, so scheduled work survives restarts and a job
+that came due while no process was running runs on the next start. A
+worker thread holds the jobs due within ``horizon`` in a heap and sleeps
+until the earliest one. Finding them is one range read of that index
+per horizon (or per ``batch`` jobs), never a scan of every job.
+
+Any number of processes may run a scheduler over the same table. ``run``
+must claim a job by deleting its row in the transaction that does the
+work, so whichever process gets there first runs it and the others skip
+it.
+"""
+import heapq
+import threading
+from datetime import datetime, timedelta
+
+# Recurring challenge types and how often they come round
+PERIODS = {'daily': timedelta(days=1), 'weekly': timedelta(weeks=1)}
+
+
+def next_occurrence(due, period, now):
+    """The first ``due + n * period`` after ``now``; missed periods are skipped, not replayed."""
+    return due + period * max((now - due) // period + 1, 1)
+
+
+class Scheduler:
+    """Heap of the next due ``(run_at, job_id)`` pairs, refilled from ``load``.
+
+    ``load(until, limit)`` returns up to ``limit`` pairs with ``run_at`` at
+    or before ``until``, earliest first; ``run(job_id)`` runs one job and
+    must tolerate jobs that another process already ran. The thread starts
+    on the first :meth:`start` in each process.
+    """
+
+    def __init__(self, load, run, horizon=60, batch=1000, retry=5, on_error=None, clock=datetime.utcnow):
+        self._load = load
+        self._run_job = run
+        self.horizon = timedelta(seconds=horizon)
+        self.batch = batch
+        self.retry = retry
+        self._on_error = on_error
+        self._clock = clock
+        self._heap = []
+        self._loaded_until = None
+        self._notified = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.ran = 0
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='job-scheduler', daemon=True)
+                self._thread.start()
+
+    def notify(self, run_at):
+        """Jobs due at ``run_at`` were committed; reload if they fall in the loaded window."""
+        with self._lock:
+            self._notified += 1
+            if self._loaded_until is not None and run_at <= self._loaded_until:
+                self._loaded_until = None
+        self._wakeup.set()
+
+    def pending(self):
+        with self._lock:
+            return len(self._heap)
+
+    def _refill(self, now):
+        until = now + self.horizon
+        with self._lock:
+            notified = self._notified
+        jobs = list(self._load(until, self.batch))
+        with self._lock:
+            self._heap = jobs
+            heapq.heapify(self._heap)
+            if self._notified != notified:
+                # Jobs committed while loading may be missing: load again next round
+                self._loaded_until = None
+            elif len(jobs) >= self.batch:
+                # A full batch can stop short of the horizon: load again after its last job
+                self._loaded_until = jobs[-1][0]
+            else:
+                self._loaded_until = until
+
+    def run_pending(self):
+        """Run every job due now in the calling thread and return how many ran."""
+        ran = 0
+        while True:
+            now = self._clock()
+            if self._loaded_until is None or now >= self._loaded_until:
+                self._refill(now)
+            with self._lock:
+                if not self._heap or self._heap[0][0] > now:
+                    return ran
+                _, job_id = heapq.heappop(self._heap)
+            try:
+                self._run_job(job_id)
+            except Exception as exc:
+                if self._on_error is not None:
+                    self._on_error(exc)
+            ran += 1
+            self.ran += 1
+
+    def _seconds_to_next(self):
+        with self._lock:
+            if self._loaded_until is None:
+                return 0
+            next_at = min(self._heap[0][0], self._loaded_until) if self._heap else self._loaded_until
+        return max((next_at - self._clock()).total_seconds(), 0)
+
+    def _run(self):
+        while True:
+            try:
+                self.run_pending()
+                wait = self._seconds_to_next()
+            except Exception as exc:
+                # Database unavailable: try again shortly
+                if self._on_error is not None:
+                    self._on_error(exc)
+                wait = self.retry
+            self._wakeup.wait(wait)
+            self._wakeup.clear()
@@ -0,0 +1,126 @@
+"""SQLite FTS5 search over discussions and class activities.
+
+One ``search_index`` table holds the searchable text of every discussion
+post, quiz, poll and challenge. Triggers on the source tables keep it in
+step with every write path (endpoints, bulk imports, cascading deletes),
+so nothing else has to remember to update it.
+
+Row ids encode their source as ``id * 4 + kind``, so a trigger replaces
+or removes exactly one row. The class is stored as a ``c<id>`` token, so
+a class-scoped query intersects the term's matches with the class's
+instead of filtering every match in the school.
+"""
+import re
+from html import escape
+
+KINDS = ('discussion', 'quiz', 'poll', 'challenge')
+MAX_TERMS = 16
+
+# kind -> (table, title, body), with {row} standing for new/old in triggers
+SOURCES = {
+    'discussion': ('discussion_post', "''", '{row}.content'),
+    # Multi-question quizzes index every question and option of their list
+    'quiz': ('quiz', '{row}.title', "coalesce((SELECT group_concat(value, ' ') FROM json_tree({row}.questions) "
+                                    "WHERE type = 'text'), "
+                                    "{row}.question || ' ' || {row}.option_a || ' ' || {row}.option_b || ' ' || "
+                                    "{row}.option_c || ' ' || {row}.option_d)"),
+    'poll': ('poll', "''", "{row}.question || ' ' || {row}.option_1 || ' ' || {row}.option_2 || ' ' || "
+                           "coalesce({row}.option_3, '') || ' ' || coalesce({row}.option_4, '')"),
+    'challenge': ('challenge', '{row}.title', '{row}.description'),
+}
+
+# Matches are wrapped in control characters by SQLite, then the text is
+# escaped and they become <mark> tags
+_OPEN, _CLOSE = '\x02', '\x03'
+_TERMS = re.compile(r'\w+')
+
+
+def supported(engine):
+    return engine.dialect.name == 'sqlite'
+
+
+def _columns(kind, row, sources):
+    _, title, body = sources[kind]
+    return (f'{row}.id * {len(KINDS)} + {KINDS.index(kind)}', title.format(row=row), body.format(row=row),
+            f"'c' || {row}.class_id")
+
+
+def install(connection, sources=SOURCES):
+    """Create the index table and its triggers; True when the table is new.
+
+    Migrations pass the ``sources`` of their schema version, since a source
+    may read columns that later versions added.
+    """
+    created = connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_index'").first() is None
+    connection.exec_driver_sql(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+        "title, body, class_ref, tokenize = 'unicode61 remove_diacritics 2')")
+    # Titles weigh more than bodies; the class token never counts towards rank
+    connection.exec_driver_sql("INSERT INTO search_index(search_index, rank) VALUES ('rank', 'bm25(4.0, 1.0, 0.0)')")
+    for kind, (table, _, _) in sources.items():
+        insert = 'INSERT INTO search_index(rowid, title, body, class_ref) VALUES ({}, {}, {}, {});'.format(
+            *_columns(kind, 'new', sources))
+        delete = f'DELETE FROM search_index WHERE rowid = {_columns(kind, "old", sources)[0]};'
+        connection.exec_driver_sql(
+            f'CREATE TRIGGER IF NOT EXISTS {table}_search_insert AFTER INSERT ON {table} BEGIN {insert} END')
+        connection.exec_driver_sql(
+            f'CREATE TRIGGER IF NOT EXISTS {table}_search_delete AFTER DELETE ON {table} BEGIN {delete} END')
+        connection.exec_driver_sql(
+            f'CREATE TRIGGER IF NOT EXISTS {table}_search_update AFTER UPDATE ON {table} BEGIN {delete} {insert} END')
+    return created
+
+
+def drop_triggers(connection, kind):
+    """Drop the triggers of one source, so :func:`install` recreates them from ``SOURCES``."""
+    table = SOURCES[kind][0]
+    for operation in ('insert', 'delete', 'update'):
+        connection.exec_driver_sql(f'DROP TRIGGER IF EXISTS {table}_search_{operation}')
+
+
+def rebuild(connection, sources=SOURCES):
+    """Refill the index from the source tables and return the rows indexed."""
+    connection.exec_driver_sql('DELETE FROM search_index')
+    total = 0
+    for kind, (table, _, _) in sources.items():
+        total += connection.exec_driver_sql(
+            'INSERT INTO search_index(rowid, title, body, class_ref) SELECT {}, {}, {}, {} FROM {} AS source'.format(
+                *_columns(kind, 'source', sources), table)).rowcount
+    connection.exec_driver_sql("INSERT INTO search_index(search_index) VALUES ('optimize')")
+    return total
+
+
+def match_expression(text, class_id):
+    """FTS5 query for the words of ``text`` within one class, or None without words.
+
+    Every word must appear in the title or body; the last one also matches
+    as a prefix, so results follow the user's typing. User input never
+    reaches the FTS5 query syntax except as quoted words.
+    """
+    terms = _TERMS.findall(text or '')[:MAX_TERMS]
+    if not terms:
+        return None
+    words = ' '.join(f'"{term}"' for term in terms) + '*'
+    return f'class_ref : "c{int(class_id)}" AND {{title body}} : ({words})'
+
+
+def _marked(text):
+    return escape(text or '').replace(_OPEN, '<mark>').replace(_CLOSE, '</mark>')
+
+
+def search(connection, expression, offset, limit):
+    """One page of ranked hits and the total number of matches."""
+    rows = connection.exec_driver_sql(
+        f"SELECT rowid, highlight(search_index, 0, '{_OPEN}', '{_CLOSE}'), "
+        f"snippet(search_index, 1, '{_OPEN}', '{_CLOSE}', '…', 16) "
+        "FROM search_index WHERE search_index MATCH ? ORDER BY rank LIMIT ? OFFSET ?",
+        (expression, limit, offset)).all()
+    total = connection.exec_driver_sql(
+        'SELECT count(*) FROM search_index WHERE search_index MATCH ?', (expression,)).scalar()
+    hits = [{
+        'type': KINDS[rowid % len(KINDS)],
+        'id': rowid // len(KINDS),
+        'title': _marked(title) or None,
+        'snippet': _marked(snippet),
+    } for rowid, title, snippet in rows]
+    return hits, total
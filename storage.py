@@ -0,0 +1,71 @@
+"""Storage helpers: SQLite connection pragmas, lock retries and read routing."""
+import functools
+import time
+
+from flask import g, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+
+READER_BIND = 'reader'
+
+
+def apply_sqlite_pragmas(engine, pragmas, read_only=False):
+    """Run ``pragmas`` on every new connection of a SQLite ``engine``."""
+    if engine.dialect.name != 'sqlite' or not (pragmas or read_only):
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        if read_only:
+            cursor.execute('PRAGMA query_only=ON')
+        cursor.close()
+
+
+def is_locked_error(exc):
+    if not isinstance(exc, OperationalError):
+        return False
+    message = str(exc.orig).lower()
+    return 'database is locked' in message or 'database table is locked' in message
+
+
+def lock_retry(session, retries=3, delay=0.05, on_retry=None):
+    """Decorator that reruns a write when SQLite reports the database as locked.
+
+    The session is rolled back before every retry, so the wrapped function
+    must do all of its reads and writes inside the call. ``on_retry`` is
+    called with the backoff in seconds before each retry.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            for attempt in range(retries + 1):
+                try:
+                    return func(*args, **kwargs)
+                except OperationalError as exc:
+                    if attempt == retries or not is_locked_error(exc):
+                        raise
+                    session.rollback()
+                    if on_retry is not None:
+                        on_retry(delay * 2 ** attempt)
+                    time.sleep(delay * 2 ** attempt)
+        return wrapper
+    return decorator
+
+
+class RoutingSession(Session):
+    """Session that sends plain SELECTs of read-only requests to the reader pool.
+
+    A request opts in by setting ``g.read_only``. Flushes and DML always go
+    to the primary engine, so a GET that ends up writing stays correct.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and has_request_context() and g.get('read_only')
+                and clause is not None and getattr(clause, 'is_select', False)
+                and READER_BIND in self._db.engines):
+            return self._db.engines[READER_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
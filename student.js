@@ -1,39 +1,30 @@
 // Student-specific JavaScript
 
-// Load user data on page load
-document.addEventListener('DOMContentLoaded', function() {
-    updateUserPoints();
-    updateBadgeCount();
+// Pushed by the event stream in main.js
+document.addEventListener('elearning:points', e => {
+    const pointsElement = document.querySelector('.dashboard-stats .stat-card h3');
+    if (pointsElement) {
+        pointsElement.textContent = e.detail.points;
+    }
 });
 
-function updateUserPoints() {
-    fetch('/api/user/points')
-        .then(response => response.json())
-        .then(data => {
-            if (data.points !== undefined) {
-                if (document.getElementById('user-points')) {
-                    document.getElementById('user-points').textContent = data.points;
-                }
-                // Update points in dashboard stats
-                const pointsElement = document.querySelector('.dashboard-stats .stat-card h3');
-                if (pointsElement && pointsElement.textContent !== data.points.toString()) {
-                    pointsElement.textContent = data.points;
-                }
-            }
-        })
-        .catch(() => {});
-}
+document.addEventListener('elearning:new_activity', e => {
+    const modal = document.getElementById('classDetailModal');
+    if (modal.style.display === 'block' && currentClassId === e.detail.class_id) {
+        openClass(currentClassId);
+    }
+});
 
-function updateBadgeCount() {
-    fetch('/api/badges')
-        .then(response => response.json())
-        .then(data => {
-            if (document.getElementById('badge-count')) {
-                document.getElementById('badge-count').textContent = data.length;
-            }
-        })
-        .catch(() => {});
-}
+// Dashboard data is rendered with the page; main.js re-fetches it after a resync
+document.addEventListener('elearning:dashboard', e => {
+    const pointsElement = document.querySelector('.dashboard-stats .stat-card h3');
+    if (pointsElement && e.detail.profile) {
+        pointsElement.textContent = e.detail.profile.points;
+    }
+    if (document.getElementById('badge-count') && e.detail.badges) {
+        document.getElementById('badge-count').textContent = e.detail.badges.length;
+    }
+});
 
 function showJoinClassModal() {
     document.getElementById('joinClassModal').style.display = 'block';
@@ -70,7 +61,10 @@ document.getElementById('joinClassForm').addEventListener('submit', async (e) =>
     }
 });
 
+let currentClassId = null;
+
 function openClass(classId) {
+    currentClassId = classId;
     fetch(`/api/classes/${classId}`)
         .then(response => response.json())
         .then(data => {
@@ -138,7 +132,7 @@ function openClass(classId) {
             
             // Discussion Section
             content += '<div class="discussion-section"><h3>💬 Discussion</h3>';
-            content += '<button class="btn btn-primary btn-small" onclick="loadDiscussions(${classId})">Load Discussions</button>';
+            content += '<button class="btn btn-primary btn-small" onclick="loadDiscussions(' + classId + ')">Load Discussions</button>';
             content += '<div id="discussionsContainer"></div></div>';
             
             document.getElementById('classDetailContent').innerHTML = content;
@@ -154,6 +148,10 @@ function takeQuiz(quizId) {
     fetch(`/api/quiz/${quizId}`)
         .then(response => response.json())
         .then(data => {
+            if (data.questions) {
+                takeQuizSheet(quizId, data);
+                return;
+            }
             let quizHTML = `
                 <h2>${data.title}</h2>
                 <p><strong>${data.question}</strong></p>
@@ -182,6 +180,72 @@ function takeQuiz(quizId) {
         });
 }
 
+// Multi-question quizzes: one answer per question, blanks allowed, submitted as one sheet
+function takeQuizSheet(quizId, data) {
+    let quizHTML = `<h2>${data.title}</h2>`;
+    data.questions.forEach((question, position) => {
+        quizHTML += `<p><strong>${position + 1}. ${question.question}</strong></p><div class="quiz-options">`;
+        question.options.forEach((option, index) => {
+            const letter = 'abcd'[index];
+            quizHTML += `
+                <div class="quiz-option" data-question="${position}" onclick="selectQuizSheetOption(this, ${position}, '${letter}')">
+                    <strong>${letter.toUpperCase()}:</strong> ${option}
+                </div>
+            `;
+        });
+        quizHTML += '</div>';
+    });
+    quizHTML += `<button class="btn btn-primary" onclick="submitQuizSheet(${quizId})">Submit Answers</button>`;
+    showModal('quizModal', quizHTML);
+    window.currentQuizAnswers = data.questions.map(() => null);
+}
+
+function selectQuizSheetOption(element, position, answer) {
+    document.querySelectorAll(`.quiz-option[data-question="${position}"]`).forEach(opt => opt.classList.remove('selected'));
+    element.classList.add('selected');
+    window.currentQuizAnswers[position] = answer;
+}
+
+function submitQuizSheet(quizId) {
+    const blanks = window.currentQuizAnswers.filter(answer => answer === null).length;
+    if (blanks && !confirm(`${blanks} question(s) left blank. Submit anyway? A quiz can only be submitted once.`)) {
+        return;
+    }
+    
+    fetch('/api/submit_quiz', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({
+            quiz_id: quizId,
+            answers: window.currentQuizAnswers
+        })
+    })
+    .then(response => response.json().then(data => ({ok: response.ok, data})))
+    .then(({ok, data}) => {
+        if (!ok) {
+            alert(data.error || 'Failed to submit quiz');
+            return;
+        }
+        let resultHTML = `
+            <h2>Quiz Result</h2>
+            <p style="font-size: 1.2rem; margin: 1rem 0;">
+                ${data.score} / ${data.question_count} correct
+            </p>
+            <p><strong>Points Earned:</strong> ${data.points_earned}</p>
+        `;
+        data.results.forEach((correct, position) => {
+            resultHTML += `<p>${position + 1}. ${correct ? '✅' : '❌'} <strong>Correct Answer:</strong> ${data.correct_answers[position].toUpperCase()}</p>`;
+        });
+        resultHTML += `<button class="btn btn-primary" onclick="closeModal('quizResultModal'); location.reload();">Close</button>`;
+        showModal('quizResultModal', resultHTML);
+        closeModal('quizModal');
+    })
+    .catch(error => {
+        console.error('Error:', error);
+        alert('Failed to submit quiz');
+    });
+}
+
 function selectQuizOption(element, answer) {
     document.querySelectorAll('.quiz-option').forEach(opt => opt.classList.remove('selected'));
     element.classList.add('selected');
@@ -203,8 +267,12 @@ function submitQuiz(quizId) {
             answer: window.currentQuizAnswer
         })
     })
-    .then(response => response.json())
-    .then(data => {
+    .then(response => response.json().then(data => ({ok: response.ok, data})))
+    .then(({ok, data}) => {
+        if (!ok) {
+            alert(data.error || 'Failed to submit quiz');
+            return;
+        }
         let resultHTML = `
             <h2>Quiz Result</h2>
             <p style="font-size: 1.2rem; margin: 1rem 0;">
@@ -347,10 +415,10 @@ function markAttendance(classId) {
         headers: {'Content-Type': 'application/json'},
         body: JSON.stringify({class_id: classId})
     })
-    .then(response => response.json())
-    .then(data => {
-        if (response.ok) {
-            alert(`Attendance marked! Total attendance: ${data.attendance_count}`);
+    .then(response => response.json().then(data => ({ok: response.ok, data})))
+    .then(({ok, data}) => {
+        if (ok) {
+            alert(`${data.message}! Total attendance: ${data.attendance_count}`);
         } else {
             alert(data.error || 'Failed to mark attendance');
         }
@@ -361,47 +429,6 @@ function markAttendance(classId) {
     });
 }
 
-function loadDiscussions(classId) {
-    fetch(`/api/discussion/${classId}`)
-        .then(response => response.json())
-        .then(data => {
-            let discussionsHTML = '<h3>Discussion Board</h3>';
-            discussionsHTML += '<button class="btn btn-primary btn-small" onclick="showCreateDiscussionModal(' + classId + ')">New Post</button>';
-            discussionsHTML += '<div style="margin-top: 1rem;">';
-            
-            if (data.length === 0) {
-                discussionsHTML += '<p>No discussions yet. Start one!</p>';
-            } else {
-                data.forEach(post => {
-                    discussionsHTML += `
-                        <div class="discussion-post">
-                            <div class="discussion-post-header">
-                                <span><strong>${post.username}</strong></span>
-                                <span>${new Date(post.created_at).toLocaleString()}</span>
-                            </div>
-                            <p>${post.content}</p>
-                            ${post.replies.length > 0 ? '<div class="discussion-replies">' + post.replies.map(r => `
-                                <div class="discussion-post" style="margin-top: 0.5rem;">
-                                    <div class="discussion-post-header">
-                                        <span><strong>${r.username}</strong></span>
-                                        <span>${new Date(r.created_at).toLocaleString()}</span>
-                                    </div>
-                                    <p>${r.content}</p>
-                                </div>
-                            `).join('') + '</div>' : ''}
-                        </div>
-                    `;
-                });
-            }
-            discussionsHTML += '</div>';
-            document.getElementById('discussionsContainer').innerHTML = discussionsHTML;
-        })
-        .catch(error => {
-            console.error('Error:', error);
-            alert('Failed to load discussions');
-        });
-}
-
 function showCreateDiscussionModal(classId) {
     const modalContent = `
         <h2>New Discussion Post</h2>
@@ -434,7 +461,7 @@ function showCreateDiscussionModal(classId) {
             if (response.ok) {
                 alert('Post created successfully!');
                 closeModal('createDiscussionModal');
-                loadDiscussions(formData.class_id);
+                refreshDiscussions(formData.class_id);
             } else {
                 alert(data.error || 'Failed to create post');
             }
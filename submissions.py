@@ -0,0 +1,101 @@
+"""Group-commit queue for activity submissions.
+
+Request threads enqueue submissions and wait on a future; a single writer
+thread drains the queue in groups and hands each group to ``apply_batch``
+so a burst of submissions costs one transaction instead of one per
+request.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class QueueFull(Exception):
+    """Raised when the queue is at capacity and the caller should back off."""
+
+
+class Submission:
+    __slots__ = ('kind', 'user_id', 'data', 'future')
+
+    def __init__(self, kind, user_id, data):
+        self.kind = kind
+        self.user_id = user_id
+        self.data = data
+        self.future = Future()
+
+
+class SubmissionQueue:
+    """Bounded queue with a writer thread that applies submissions in groups.
+
+    ``apply_batch`` receives a list of :class:`Submission` and returns one
+    result per item in the same order. A group is flushed once
+    ``max_batch`` items are waiting or ``flush_window`` seconds have passed
+    since its first item arrived. With ``flush_window`` set to 0 no thread
+    is started and every call is applied inline by the caller.
+    """
+
+    def __init__(self, apply_batch, max_size=2000, max_batch=200, flush_window=0.005):
+        self._apply_batch = apply_batch
+        self._queue = queue.Queue(maxsize=max_size)
+        self.max_batch = max_batch
+        self.flush_window = flush_window
+        self._thread = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.applied = 0
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='submission-writer', daemon=True)
+                self._thread.start()
+
+    def submit_many(self, submissions):
+        """Queue ``(kind, user_id, data)`` tuples and return their futures."""
+        items = [Submission(kind, user_id, data) for kind, user_id, data in submissions]
+        if self.flush_window <= 0:
+            self._apply(items)
+            return [item.future for item in items]
+        self._ensure_worker()
+        for item in items:
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                item.future.set_exception(QueueFull())
+        return [item.future for item in items]
+
+    def submit(self, kind, user_id, data):
+        return self.submit_many([(kind, user_id, data)])[0]
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def _apply(self, items):
+        try:
+            results = self._apply_batch(items)
+        except Exception as exc:
+            for item in items:
+                if not item.future.done():
+                    item.future.set_exception(exc)
+            return
+        self.batches += 1
+        self.applied += len(items)
+        for item, result in zip(items, results):
+            item.future.set_result(result)
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_window
+            while len(items) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._apply(items)
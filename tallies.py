@@ -0,0 +1,73 @@
+"""In-memory poll option tallies backed by the persisted counters table.
+
+Reading a poll's results is a dict lookup. The submission writer calls
+``begin`` before committing a group and ``commit`` after, so a tally
+loaded from the database while a group is in flight is served but never
+cached: that is what keeps a concurrent load from either missing or
+double counting the group's votes.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class PollTallies:
+    """LRU of ``poll_id -> {option: count}``.
+
+    ``load(poll_id)`` returns the persisted counts for one poll. Cached
+    tallies are reloaded after ``ttl`` seconds so processes that did not
+    apply a vote themselves converge.
+    """
+
+    def __init__(self, load, max_polls=10000, ttl=60):
+        self._load = load
+        self.max_polls = max_polls
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._tallies = OrderedDict()
+        self._generations = {}
+        self._in_flight = {}
+
+    def get(self, poll_id):
+        with self._lock:
+            cached = self._tallies.get(poll_id)
+            if cached is not None and time.monotonic() - cached[1] < self.ttl:
+                self._tallies.move_to_end(poll_id)
+                return dict(cached[0])
+            generation = self._generations.get(poll_id, 0)
+        counts = dict(self._load(poll_id))
+        with self._lock:
+            if self._generations.get(poll_id, 0) == generation and not self._in_flight.get(poll_id):
+                self._tallies[poll_id] = (counts, time.monotonic())
+                self._tallies.move_to_end(poll_id)
+                while len(self._tallies) > self.max_polls:
+                    self._tallies.popitem(last=False)
+        return dict(counts)
+
+    def begin(self, poll_ids):
+        with self._lock:
+            for poll_id in poll_ids:
+                self._in_flight[poll_id] = self._in_flight.get(poll_id, 0) + 1
+                self._generations[poll_id] = self._generations.get(poll_id, 0) + 1
+
+    def commit(self, votes):
+        """Apply committed ``{(poll_id, option): count}`` and end the in-flight window."""
+        with self._lock:
+            for (poll_id, option), count in votes.items():
+                cached = self._tallies.get(poll_id)
+                if cached is not None:
+                    cached[0][option] = cached[0].get(option, 0) + count
+            self._finish({poll_id for poll_id, _ in votes})
+
+    def abort(self, poll_ids):
+        with self._lock:
+            self._finish(poll_ids)
+
+    def _finish(self, poll_ids):
+        for poll_id in poll_ids:
+            self._generations[poll_id] = self._generations.get(poll_id, 0) + 1
+            remaining = self._in_flight.get(poll_id, 0) - 1
+            if remaining > 0:
+                self._in_flight[poll_id] = remaining
+            else:
+                self._in_flight.pop(poll_id, None)
@@ -1,36 +1,19 @@
 // Teacher-specific JavaScript
 
-// Load dashboard stats on page load
-document.addEventListener('DOMContentLoaded', function() {
-    updateDashboardStats();
-    updateUserPoints();
-});
-
-function updateDashboardStats() {
-    // Calculate total students and activities
+// Dashboard stats are rendered with the page; main.js re-fetches them after a resync
+document.addEventListener('elearning:dashboard', e => {
+    if (!e.detail.classes) {
+        return;
+    }
     let totalStudents = 0;
     let totalActivities = 0;
-    
-    // This would ideally come from an API, but for now we'll calculate from classes
-    const classCards = document.querySelectorAll('.class-card');
-    if (classCards.length > 0) {
-        // For demo purposes, we'll set some default values
-        // In a real app, this would come from an API call
-        document.getElementById('total-students').textContent = '2'; // Sample
-        document.getElementById('total-activities').textContent = '9'; // Sample (3 quizzes + 3 polls + 3 challenges)
-    }
-}
-
-function updateUserPoints() {
-    fetch('/api/user/points')
-        .then(response => response.json())
-        .then(data => {
-            if (data.points !== undefined && document.getElementById('user-points')) {
-                document.getElementById('user-points').textContent = data.points;
-            }
-        })
-        .catch(() => {});
-}
+    e.detail.classes.forEach(cls => {
+        totalStudents += cls.enrollments;
+        totalActivities += cls.quizzes + cls.polls + cls.challenges;
+    });
+    document.getElementById('total-students').textContent = totalStudents;
+    document.getElementById('total-activities').textContent = totalActivities;
+});
 
 function showCreateClassModal() {
     document.getElementById('createClassModal').style.display = 'block';
@@ -81,6 +64,30 @@ document.getElementById('createClassForm').addEventListener('submit', async (e)
     }
 });
 
+async function startSession(classId) {
+    const title = prompt('Session title (optional):');
+    if (title === null) {
+        return;
+    }
+    
+    try {
+        const response = await fetch(`/api/classes/${classId}/sessions`, {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({title: title || null})
+        });
+        
+        const data = await response.json();
+        if (response.ok) {
+            alert('Session started! Students can now mark their attendance.');
+        } else {
+            alert(data.error || 'Failed to start session');
+        }
+    } catch (error) {
+        alert('An error occurred');
+    }
+}
+
 function copyClassCode(classCode) {
     navigator.clipboard.writeText(classCode).then(() => {
         alert(`Class code "${classCode}" copied to clipboard!`);
@@ -105,6 +112,7 @@ function openClass(classId) {
                 <p>${data.description}</p>
                 <div style="margin: 1rem 0; padding: 1rem; background: var(--light-color); border-radius: 5px;">
                     <strong>Class Code:</strong> ${data.class_code} | <strong>Students:</strong> ${data.enrollments}
+                    <button class="btn btn-secondary btn-small" onclick="startSession(${classId})">Start Session</button>
                 </div>
             `;
             
@@ -132,6 +140,7 @@ function openClass(classId) {
                     <div class="activity-card">
                         <h4>${poll.question}</h4>
                         <p><strong>Points:</strong> ${poll.points}</p>
+                        <button class="btn btn-secondary btn-small" onclick="showPollResults(${poll.id})">Live Results</button>
                     </div>
                 `;
             });
@@ -310,6 +319,84 @@ function showCreatePollModal(classId) {
     });
 }
 
+let pollResultsSource = null;
+let pollResultsTimer = null;
+
+function renderPollTally(tally) {
+    document.querySelectorAll('.poll-result').forEach(row => {
+        const count = tally.counts[row.dataset.option] || 0;
+        const percent = tally.total ? (count / tally.total * 100) : 0;
+        row.querySelector('.poll-result-count').textContent = `${count} (${percent.toFixed(0)}%)`;
+        row.querySelector('.poll-result-bar').style.width = `${percent}%`;
+    });
+    const total = document.getElementById('pollResultsTotal');
+    if (total) {
+        total.textContent = tally.total;
+    }
+}
+
+function refreshPollResults(pollId) {
+    if (document.getElementById('pollResultsModal').style.display === 'none') {
+        clearInterval(pollResultsTimer);
+        return;
+    }
+    fetch(`/api/poll/${pollId}/results`)
+        .then(response => response.json())
+        .then(renderPollTally)
+        .catch(() => {});
+}
+
+function showPollResults(pollId) {
+    fetch(`/api/poll/${pollId}/results`)
+        .then(response => response.json())
+        .then(data => {
+            let resultsHTML = `<h2>📊 ${data.question}</h2><p><strong>Votes:</strong> <span id="pollResultsTotal">${data.total}</span></p>`;
+            data.options.forEach(option => {
+                resultsHTML += `
+                    <div class="poll-result" data-option="${option.option}" style="margin: 0.75rem 0;">
+                        <div style="display: flex; justify-content: space-between;">
+                            <span>${option.text}</span>
+                            <span class="poll-result-count"></span>
+                        </div>
+                        <div style="background: var(--light-color); border-radius: 5px; height: 0.75rem;">
+                            <div class="poll-result-bar" style="background: var(--primary-color); border-radius: 5px; height: 100%; width: 0;"></div>
+                        </div>
+                    </div>
+                `;
+            });
+            showModal('pollResultsModal', resultsHTML);
+            renderPollTally(data);
+
+            // Votes are pushed while the results are open
+            if (pollResultsSource) {
+                pollResultsSource.close();
+            }
+            clearInterval(pollResultsTimer);
+            if (window.EventSource) {
+                pollResultsSource = new EventSource(`/api/poll/${pollId}/results/stream`);
+                pollResultsSource.addEventListener('tally', e => {
+                    if (document.getElementById('pollResultsModal').style.display === 'none') {
+                        pollResultsSource.close();
+                        pollResultsSource = null;
+                        return;
+                    }
+                    renderPollTally(JSON.parse(e.data));
+                });
+                // Turned away while the server holds its most streams: poll instead
+                pollResultsSource.onerror = () => {
+                    if (pollResultsSource && pollResultsSource.readyState === EventSource.CLOSED) {
+                        pollResultsSource = null;
+                        pollResultsTimer = setInterval(() => refreshPollResults(pollId), 3000);
+                    }
+                };
+            }
+        })
+        .catch(error => {
+            console.error('Error:', error);
+            alert('Failed to load poll results');
+        });
+}
+
 function showCreateChallengeModal(classId) {
     const modalContent = `
         <h2>Create Challenge</h2>
@@ -401,47 +488,6 @@ function viewAnalytics(classId) {
         });
 }
 
-function loadDiscussions(classId) {
-    fetch(`/api/discussion/${classId}`)
-        .then(response => response.json())
-        .then(data => {
-            let discussionsHTML = '<h3>Discussion Board</h3>';
-            discussionsHTML += '<button class="btn btn-primary btn-small" onclick="showCreateDiscussionModal(' + classId + ')">New Post</button>';
-            discussionsHTML += '<div style="margin-top: 1rem;">';
-            
-            if (data.length === 0) {
-                discussionsHTML += '<p>No discussions yet. Start one!</p>';
-            } else {
-                data.forEach(post => {
-                    discussionsHTML += `
-                        <div class="discussion-post">
-                            <div class="discussion-post-header">
-                                <span><strong>${post.username}</strong></span>
-                                <span>${new Date(post.created_at).toLocaleString()}</span>
-                            </div>
-                            <p>${post.content}</p>
-                            ${post.replies.length > 0 ? '<div class="discussion-replies">' + post.replies.map(r => `
-                                <div class="discussion-post" style="margin-top: 0.5rem;">
-                                    <div class="discussion-post-header">
-                                        <span><strong>${r.username}</strong></span>
-                                        <span>${new Date(r.created_at).toLocaleString()}</span>
-                                    </div>
-                                    <p>${r.content}</p>
-                                </div>
-                            `).join('') + '</div>' : ''}
-                        </div>
-                    `;
-                });
-            }
-            discussionsHTML += '</div>';
-            document.getElementById('discussionsContainer').innerHTML = discussionsHTML;
-        })
-        .catch(error => {
-            console.error('Error:', error);
-            alert('Failed to load discussions');
-        });
-}
-
 function showCreateDiscussionModal(classId) {
     const modalContent = `
         <h2>New Discussion Post</h2>
@@ -474,7 +520,7 @@ function showCreateDiscussionModal(classId) {
             if (response.ok) {
                 alert('Post created successfully!');
                 closeModal('createDiscussionModal');
-                loadDiscussions(formData.class_id);
+                refreshDiscussions(formData.class_id);
             } else {
                 alert(data.error || 'Failed to create post');
             }
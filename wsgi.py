@@ -0,0 +1,4 @@
+"""Production entry point: ``gunicorn -c gunicorn.conf.py wsgi:app``."""
+from app import checked_app
+
+app = checked_app()